@@ -0,0 +1,383 @@
+import argparse
+import gc
+import json
+import random
+import resource
+import sys
+from itertools import count
+from multiprocessing import Pool
+from timeit import default_timer
+from graph import *
+from generator import SHAPES, generate
+
+# Default number of users in each benchmarked graph
+SCALES = [10000, 100000]
+
+# Fractions of the graph's users to target when benchmarking infections
+TARGET_FRACTIONS = [0.01, 0.1, 0.5]
+
+# Tolerances (as fractions of the target) for approximate infection
+EPSILON_FRACTIONS = [0.0, 0.01, 0.1]
+
+# We skip approximate infections whose solution table would have more
+# than this many cells, since they'd take far too long to finish
+MAX_DP_CELLS = 50000000
+
+# Number of edges, and then users, removed when benchmarking removals
+REMOVALS = 1000
+
+# Number of times each operation is timed; we report the median run
+REPEAT = 7
+
+# A metric regresses if it is this much slower than in the baseline
+REGRESSION_THRESHOLD = 0.2
+
+# Timings shorter than this (in seconds) are too noisy to compare
+MIN_SECONDS = 0.01
+
+# Size of a fixed workload that's timed just before and just after each
+# benchmark call to measure how fast the machine was running at the time
+# (see compare)
+CALIBRATION_SIZE = 100000
+
+def timed(function, *args):
+	'''
+	Returns a tuple of the form (seconds, result) describing a call to
+	<function> with the passed in arguments.
+
+	Like timeit, we pause the garbage collector during the call. Otherwise
+	whichever call happened to trigger a full collection of the graph's
+	objects would be much slower than the rest.
+	'''
+
+	gc_was_enabled = gc.isenabled()
+	gc.disable()
+	try:
+		start = default_timer()
+		result = function(*args)
+		return (default_timer() - start, result)
+	finally:
+		if gc_was_enabled:
+			gc.enable()
+
+def calibrate():
+	'''
+	A fixed workload of the same kind as the graph's (building and looking
+	up sets in a dict), whose speed follows the benchmarks' much more
+	closely than pure arithmetic does.
+	'''
+
+	groups = {}
+	for i in xrange(CALIBRATION_SIZE):
+		groups.setdefault(i % 997, set()).add(i)
+	return len(groups)
+
+def median(values):
+	values = sorted(values)
+	return values[len(values) / 2]
+
+def median_times(repeat, benchmarks, calibrations):
+	'''
+	Times each benchmark <repeat> times, running the calibration workload
+	just before and just after each call.
+
+	Rather than timing each benchmark <repeat> times in a row, we time
+	every benchmark once per round. The speed of a shared machine can drift
+	over seconds or minutes, so this spreads each benchmark's runs over the
+	same fast and slow periods instead of putting them all in one.
+
+	Args:
+		repeat (int): The number of rounds.
+		benchmarks (list): Tuples of the form (name, function, setup).
+		If setup isn't None, it's called (untimed) before each call to
+		function, which is passed its result, e.g. to give each call a
+		fresh graph to change.
+		calibrations (list): Each calibration time is appended to this list.
+
+	Returns:
+		A tuple of the form (medians, calibrated). medians maps each
+		benchmark's name to its median time in seconds, and calibrated maps
+		each name to the median ratio of a call's time to the slower of the
+		two calibrations around it. The machine can slow down partway
+		through a call, which the calibration before the call would miss.
+	'''
+
+	times = dict((name, []) for name, function, setup in benchmarks)
+	ratios = dict((name, []) for name, function, setup in benchmarks)
+	for i in range(repeat):
+		for name, function, setup in benchmarks:
+			state = None if setup is None else setup()
+			before, result = timed(calibrate)
+			if setup is None:
+				seconds, result = timed(function)
+			else:
+				seconds, result = timed(function, state)
+			# Free this call's graph (which some benchmarks return) before
+			# the next setup builds another one
+			del state, result
+			after, result = timed(calibrate)
+			times[name].append(seconds)
+			ratios[name].append(seconds / max(before, after))
+			calibrations.extend([before, after])
+
+	medians = dict((name, median(seconds)) for name, seconds in times.iteritems())
+	calibrated = dict((name, median(values)) for name, values in ratios.iteritems())
+	return (medians, calibrated)
+
+def run_case(case):
+	'''
+	Runs every benchmark against a single generated graph. Meant to be run
+	in its own process so that the reported peak memory usage belongs to
+	this case alone. At most one copy of the graph exists at a time, so the
+	peak is that of one graph plus the largest infection's working memory.
+
+	Args:
+		case (tuple): A tuple of the form (num_users, shape, seed, repeat,
+		max_dp_cells)
+
+	Returns:
+		A dict describing the case, mapping each metric to its value, and
+		mapping each timing to its calibrated value (see median_times).
+	'''
+
+	num_users, shape, seed, repeat, max_dp_cells = case
+	random.seed(seed)
+	metrics = {}
+	calibrated = {}
+	calibrations = []
+
+	synthetic = generate(num_users, shape, seed)
+	sizes = synthetic.sizes
+	edges = zip(synthetic.coach_ids.tolist(), synthetic.student_ids.tolist())
+
+	def load(with_edges=True):
+		graph = Graph()
+		synthetic.load(graph, with_edges)
+		return graph
+
+	# Benchmarks that change the graph get a fresh one for each call. They
+	# run before we build the graph used by the other benchmarks, so that
+	# only one graph is alive at a time.
+	benchmarks = []
+	benchmarks.append(("bulk_load_users", lambda: load(False), None))
+	benchmarks.append(("add_edge", lambda graph: [graph.add_edge(*edge) for edge in edges],
+		lambda: load(False)))
+
+	# Removals may split components. Sampling edges and users uniformly
+	# means most of them are in the larger components.
+	removed_edges = random.sample(edges, min(REMOVALS, len(edges)))
+	benchmarks.append(("remove_edge",
+		lambda graph: [graph.remove_edge(*edge) for edge in removed_edges], load))
+	removed_users = random.sample(synthetic.user_ids.tolist(),
+		min(REMOVALS, len(synthetic.user_ids)))
+	benchmarks.append(("remove_user",
+		lambda graph: [graph.remove_user(user_id) for user_id in removed_users], load))
+
+	medians, ratios = median_times(repeat, benchmarks, calibrations)
+	metrics.update(medians)
+	calibrated.update(ratios)
+
+	# ru_maxrss is reported in kilobytes on Linux. Up to this point, the
+	# peak is that of a single graph being loaded and changed.
+	metrics["graph_peak_memory_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	graph = load()
+	benchmarks = []
+
+	def get_component_sizes():
+		graph.update_cache = True
+		return graph.get_component_sizes()
+	benchmarks.append(("get_component_sizes", get_component_sizes, None))
+
+	# Infect with a new version on each run so that every run changes every
+	# user it infects
+	largest = max(graph.get_component_sizes().items(), key=lambda item: item[1])[0]
+	versions = count(2)
+	def infection(method, *args):
+		return lambda: method(*(args + (next(versions),)))
+
+	benchmarks.append(("total_infection", infection(graph.total_infection, largest), None))
+
+	for target_fraction in TARGET_FRACTIONS:
+		target = int(num_users * target_fraction)
+		benchmarks.append(("limited_infection_simple/%s"%(target_fraction),
+			infection(graph.limited_infection_simple, target), None))
+		benchmarks.append(("limited_infection_components/%s"%(target_fraction),
+			infection(graph.limited_infection_components, target), None))
+
+		# An epsilon of 0 is equivalent to exact_infection
+		for epsilon_fraction in EPSILON_FRACTIONS:
+			epsilon = int(target * epsilon_fraction)
+			name = "approximate_infection/%s/%s"%(target_fraction, epsilon_fraction)
+			if (target + epsilon + 1) * (len(sizes) + 1) > max_dp_cells:
+				metrics[name] = None
+				continue
+			approximate_infection = lambda target, epsilon, version: \
+				graph.approximate_infection(target, version, epsilon)
+			benchmarks.append((name, infection(approximate_infection, target, epsilon), None))
+
+	medians, ratios = median_times(repeat, benchmarks, calibrations)
+	metrics.update(medians)
+	calibrated.update(ratios)
+	metrics["calibration"] = median(calibrations)
+
+	# Report edge and user operations as throughputs
+	for name, count_per_call in [("add_edge", len(edges)),
+		("remove_edge", len(removed_edges)), ("remove_user", len(removed_users))]:
+		seconds = metrics.pop(name)
+		metrics[name + "_per_second"] = count_per_call / seconds if seconds else None
+		ratio = calibrated.pop(name)
+		calibrated[name + "_per_second"] = count_per_call / ratio if ratio else None
+
+	metrics["peak_memory_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	return {
+		"users": num_users,
+		"shape": shape,
+		"seed": seed,
+		"components": len(sizes),
+		"metrics": metrics,
+		"calibrated": calibrated
+	}
+
+def run(scales, shapes, seed, repeat, max_dp_cells):
+	'''
+	Runs the benchmarks for each combination of scale and shape, each in a
+	fresh worker process, and returns a list of the results.
+	'''
+
+	return run_cases([(num_users, shape, seed, repeat, max_dp_cells)
+		for num_users in scales for shape in shapes])
+
+def run_cases(cases):
+	'''
+	Runs each case (see run_case) in a fresh worker process and returns a
+	list of the results.
+	'''
+
+	pool = Pool(processes=1, maxtasksperchild=1)
+	try:
+		return pool.map(run_case, cases, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+def higher_is_better(metric):
+	return metric.endswith("_per_second")
+
+def is_timing(metric):
+	return not (metric.endswith("_per_second") or metric.endswith("_kb"))
+
+def regressed(metric, old_value, new_value, threshold):
+	if higher_is_better(metric):
+		return new_value < old_value * (1 - threshold)
+	return new_value > old_value * (1 + threshold)
+
+def compare(baseline, results, threshold):
+	'''
+	Compares benchmark results against a saved baseline.
+
+	A metric only counts as a regression if both its raw value and its
+	calibrated value (see median_times) got worse by more than <threshold>.
+	The raw value alone is thrown off when the machine is busier than it
+	was for the baseline, and the calibrated value alone by noise in the
+	calibration, but it's unlikely that both are wrong in the same way.
+
+	Args:
+		baseline (dict): Previously saved benchmark output.
+		results (dict): New benchmark output.
+		threshold (float): The fraction by which a metric must get worse
+		to be considered a regression.
+
+	Returns:
+		A list of (users, shape, metric, old_value, new_value) tuples, one
+		for each metric that regressed, where the values are raw.
+	'''
+
+	old_cases = dict(((case["users"], case["shape"]), case) for case in baseline["results"])
+	regressions = []
+	for case in results["results"]:
+		old_case = old_cases.get((case["users"], case["shape"]))
+		if old_case is None:
+			continue
+		old_calibrated = old_case.get("calibrated", {})
+		new_calibrated = case.get("calibrated", {})
+
+		for metric, new_value in sorted(case["metrics"].items()):
+			old_value = old_case["metrics"].get(metric)
+			if not old_value or new_value is None or metric == "calibration":
+				continue
+			if is_timing(metric) and max(old_value, new_value) < MIN_SECONDS:
+				continue
+			if not regressed(metric, old_value, new_value, threshold):
+				continue
+
+			# Results saved without calibration are judged on raw values alone
+			if old_calibrated.get(metric) and new_calibrated.get(metric) is not None:
+				if not regressed(metric, old_calibrated[metric], new_calibrated[metric],
+					threshold):
+					continue
+			regressions.append((case["users"], case["shape"], metric, old_value, new_value))
+	return regressions
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="Benchmarks Graph operations "\
+		"and infection algorithms on generated graphs.")
+	parser.add_argument("--scales", type=int, nargs="+", default=SCALES,
+		help="Numbers of users in the generated graphs")
+	parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=SHAPES,
+		help="Component size distributions of the generated graphs")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--repeat", type=int, default=REPEAT,
+		help="Number of times to time each operation")
+	parser.add_argument("--max-dp-cells", type=int, default=MAX_DP_CELLS,
+		help="Skip approximate infections with larger solution tables")
+	parser.add_argument("--output", default="benchmark.json",
+		help="File to write results to")
+	parser.add_argument("--baseline",
+		help="Saved results to check the new results against for regressions")
+	parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+	args = parser.parse_args(argv)
+
+	results = {
+		"python": sys.version.split()[0],
+		"results": run(args.scales, args.shapes, args.seed, args.repeat,
+			args.max_dp_cells)
+	}
+	with open(args.output, "w") as output:
+		json.dump(results, output, indent=2, sort_keys=True)
+	print "Wrote results to %s"%(args.output)
+
+	if args.baseline is None:
+		return 0
+
+	with open(args.baseline) as baseline_file:
+		baseline = json.load(baseline_file)
+	regressions = compare(baseline, results, args.threshold)
+
+	# A slow spell on a shared machine can last long enough to slow every
+	# run of a few metrics, calibration or not. It's unlikely to hit the
+	# same metrics twice, so we rerun the cases with regressions and only
+	# report the metrics that regress again.
+	if len(regressions) > 0:
+		cases = sorted(set((users, shape) for users, shape, metric, old_value, new_value
+			in regressions))
+		print "Rerunning %s to confirm regressions"%(", ".join("%s users, %s"%(case)
+			for case in cases))
+		rerun = {"results": run_cases([(users, shape, args.seed, args.repeat,
+			args.max_dp_cells) for users, shape in cases])}
+		confirmed = set((users, shape, metric) for users, shape, metric, old_value, new_value
+			in compare(baseline, rerun, args.threshold))
+		regressions = [regression for regression in regressions
+			if regression[:3] in confirmed]
+
+	for users, shape, metric, old_value, new_value in regressions:
+		print "REGRESSION %s users, %s: %s went from %s to %s"%(users, shape,
+			metric, old_value, new_value)
+	if len(regressions) == 0:
+		print "No regressions against %s"%(args.baseline)
+		return 0
+	return 1
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
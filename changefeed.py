@@ -0,0 +1,295 @@
+from array import array
+
+# Kinds of change record. Each record also has two integer fields whose
+# meaning depends on its kind:
+#   CREATE_USER: (user_id, version)
+#   REMOVE_USER: (user_id, 0) - the user's edges are removed along with it
+#   ADD_EDGE: (coach_id, student_id)
+#   REMOVE_EDGE: (coach_id, student_id)
+#   SET_VERSION: (user_id, new_version)
+#   CLEAR: (0, 0) - every user was removed
+CREATE_USER = 1
+REMOVE_USER = 2
+ADD_EDGE = 3
+REMOVE_EDGE = 4
+SET_VERSION = 5
+CLEAR = 6
+
+KIND_NAMES = {
+	CREATE_USER: "create_user",
+	REMOVE_USER: "remove_user",
+	ADD_EDGE: "add_edge",
+	REMOVE_EDGE: "remove_edge",
+	SET_VERSION: "set_version",
+	CLEAR: "clear"
+}
+
+# Default number of records kept by a ChangeFeed
+DEFAULT_CAPACITY = 65536
+
+# Default number of records delivered to a subscriber's callback at once
+DEFAULT_BATCH_SIZE = 1024
+
+class Batch:
+	def __init__(self, first_sequence, kinds, firsts, seconds, missed=0):
+		'''
+		A batch of consecutive change records, stored as compact arrays.
+
+		Args:
+			first_sequence (int): The sequence number of the first record.
+			kinds (array): The kind of each record.
+			firsts (array): The first field of each record.
+			seconds (array): The second field of each record.
+			missed (int): The number of records the subscriber missed
+			(because they were overwritten before being read) immediately
+			before this batch. If this is non-zero, the subscriber's view of
+			the graph is out of date and must be rebuilt.
+		'''
+
+		self.first_sequence = first_sequence
+		self.kinds = kinds
+		self.firsts = firsts
+		self.seconds = seconds
+		self.missed = missed
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def __iter__(self):
+		'''
+		Yields (sequence, kind, first, second) tuples for each record.
+		'''
+
+		for i in xrange(len(self.kinds)):
+			yield (self.first_sequence + i, self.kinds[i], self.firsts[i], self.seconds[i])
+
+class Subscription:
+	def __init__(self, feed, callback=None, batch_size=DEFAULT_BATCH_SIZE):
+		'''
+		A consumer's position in a ChangeFeed. Subscriptions start at the end
+		of the feed, so they only see changes made after subscribing.
+
+		Args:
+			feed (ChangeFeed): The feed being consumed.
+			callback (function): If provided, the feed pushes records to
+			this function in Batches of <batch_size> records, and also
+			delivers any unread records before they'd be overwritten.
+			Otherwise, the consumer must call poll itself.
+			batch_size (int): The number of records per pushed batch.
+		'''
+
+		self.feed = feed
+		self.callback = callback
+		self.batch_size = batch_size
+
+		# Sequence number of the next record to read
+		self.cursor = feed.next_sequence
+
+	def lag(self):
+		'''
+		Returns the number of records that have been appended to the feed
+		but not yet read by this subscriber.
+		'''
+
+		return self.feed.next_sequence - self.cursor
+
+	def poll(self, max_records=None):
+		'''
+		Reads the next batch of records.
+
+		Args:
+			max_records (int): The most records to read, or None to read
+			every unread record.
+
+		Returns:
+			A Batch, which may be empty. Its missed attribute is non-zero if
+			records were overwritten before this subscriber read them.
+		'''
+
+		missed = 0
+		oldest = self.feed.oldest_sequence()
+		if self.cursor < oldest:
+			missed = oldest - self.cursor
+			self.cursor = oldest
+
+		count = self.lag()
+		if max_records is not None:
+			count = min(count, max_records)
+		batch = self.feed.read(self.cursor, count, missed)
+		self.cursor += count
+		return batch
+
+	def flush(self):
+		'''
+		Delivers every unread record to this subscriber's callback.
+		'''
+
+		while self.lag() > 0:
+			self.callback(self.poll(self.batch_size))
+
+class ChangeFeed:
+	def __init__(self, capacity=DEFAULT_CAPACITY):
+		'''
+		A ring buffer of compact records describing changes to a Graph (see
+		Graph.enable_change_feed), which subscribers consume in batches.
+
+		When the buffer is full, appending a record overwrites the oldest
+		one. Subscribers with callbacks are pushed their unread records
+		before that happens, so they never miss any; subscribers that poll
+		instead are told how many records they missed.
+
+		Args:
+			capacity (int): The number of records kept.
+		'''
+
+		self.capacity = capacity
+		self.kinds = array('b', [0]) * capacity
+		self.firsts = array('l', [0]) * capacity
+		self.seconds = array('l', [0]) * capacity
+
+		# Sequence number that the next appended record will get
+		self.next_sequence = 0
+
+		# Subscriptions with callbacks. The feed doesn't need to keep track
+		# of subscriptions that poll, so they're freed once their consumer
+		# is done with them.
+		self.push_subscriptions = []
+
+	def oldest_sequence(self):
+		'''
+		Returns the sequence number of the oldest record still in the buffer.
+		'''
+
+		return max(0, self.next_sequence - self.capacity)
+
+	def subscribe(self, callback=None, batch_size=DEFAULT_BATCH_SIZE):
+		'''
+		Returns a new Subscription to this feed (see Subscription).
+		'''
+
+		subscription = Subscription(self, callback, batch_size)
+		if callback is not None:
+			self.push_subscriptions.append(subscription)
+		return subscription
+
+	def unsubscribe(self, subscription):
+		'''
+		Stops pushing records to a subscription's callback. Subscriptions
+		that poll don't need to be unsubscribed, but may be.
+		'''
+
+		if subscription in self.push_subscriptions:
+			self.push_subscriptions.remove(subscription)
+
+	def append(self, kind, first, second):
+		'''
+		Appends a record to the feed, first pushing records to any subscriber
+		that would otherwise miss the record being overwritten, and then to
+		any subscriber that has a full batch of unread records.
+		'''
+
+		sequence = self.next_sequence
+		for subscription in self.push_subscriptions:
+			if subscription.lag() >= self.capacity:
+				subscription.flush()
+
+		index = sequence % self.capacity
+		self.kinds[index] = kind
+		self.firsts[index] = first
+		self.seconds[index] = second
+		self.next_sequence = sequence + 1
+
+		for subscription in self.push_subscriptions:
+			if subscription.lag() >= subscription.batch_size:
+				subscription.flush()
+
+	def read(self, start, count, missed=0):
+		'''
+		Returns a Batch of the <count> records starting with sequence number
+		<start>, which must still be in the buffer.
+		'''
+
+		begin = start % self.capacity
+		end = begin + count
+		if end <= self.capacity:
+			return Batch(start, self.kinds[begin:end], self.firsts[begin:end],
+				self.seconds[begin:end], missed)
+
+		# The records wrap around the end of the buffer
+		end -= self.capacity
+		return Batch(start, self.kinds[begin:] + self.kinds[:end],
+			self.firsts[begin:] + self.firsts[:end],
+			self.seconds[begin:] + self.seconds[:end], missed)
+
+class Replica:
+	def __init__(self, graph):
+		'''
+		An example consumer that keeps an incrementally updated copy of each
+		user's version and each coaching relationship in a Graph, using the
+		Graph's change feed (which must be enabled).
+		'''
+
+		self.graph = graph
+		self.subscription = graph.change_feed.subscribe()
+		self.resync()
+
+	def resync(self):
+		'''
+		Rebuilds the replica from a full scan of the graph.
+		'''
+
+		self.subscription.cursor = self.graph.change_feed.next_sequence
+		self.versions = {}
+		self.students = {}
+		self.coached_by = {}
+		for user_id, user in self.graph.users.iteritems():
+			self.versions[user_id] = user.version
+			self.students[user_id] = set(user.students)
+			self.coached_by[user_id] = set(user.coached_by)
+
+	def edges(self):
+		'''
+		Returns a set of (coach_id, student_id) tuples.
+		'''
+
+		return set((coach_id, student_id) for coach_id, students in self.students.iteritems()
+			for student_id in students)
+
+	def update(self):
+		'''
+		Applies every change made to the graph since the last update,
+		resyncing from scratch if any changes were missed.
+
+		Returns:
+			The number of records applied, or None if we had to resync.
+		'''
+
+		batch = self.subscription.poll()
+		if batch.missed:
+			self.resync()
+			return None
+
+		for sequence, kind, first, second in batch:
+			if kind == CREATE_USER:
+				self.versions[first] = second
+				self.students[first] = set()
+				self.coached_by[first] = set()
+			elif kind == SET_VERSION:
+				self.versions[first] = second
+			elif kind == REMOVE_USER:
+				del self.versions[first]
+				for student_id in self.students.pop(first):
+					self.coached_by[student_id].discard(first)
+				for coach_id in self.coached_by.pop(first):
+					self.students[coach_id].discard(first)
+			elif kind == ADD_EDGE:
+				self.students[first].add(second)
+				self.coached_by[second].add(first)
+			elif kind == REMOVE_EDGE:
+				self.students[first].discard(second)
+				self.coached_by[second].discard(first)
+			elif kind == CLEAR:
+				self.versions = {}
+				self.students = {}
+				self.coached_by = {}
+		return len(batch)
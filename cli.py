@@ -1,5 +1,7 @@
 import sys
 from graph import *
+from instrumentation import json_file_exporter
+from changefeed import KIND_NAMES
 
 class InteractiveRunner:
 	def __init__(self, graph=None):
@@ -7,8 +9,11 @@ class InteractiveRunner:
 			graph = Graph()
 		self.graph = graph
 
+		# Our subscription to the graph's change feed, if it's enabled
+		self.changes_subscription = None
+
 	def clear_graph(self):
-		self.graph.users = {}
+		self.graph.clear()
 		print "Cleared graph of all users\n"
 	def lookup(self, user_id):
 		user = self.graph.lookup_user(user_id)
@@ -61,6 +66,12 @@ class InteractiveRunner:
 		num_infected = self.graph.limited_infection_simple(quantity, version)
 		print "Infected %s users with version %s\n"%(num_infected, version)		
 
+	def component_infection(self, quantity, version):
+		num_infected, split_root = self.graph.limited_infection_components(quantity, version)
+		print "Infected %s users with version %s\n"%(num_infected, version)
+		if split_root is not None:
+			print "Partially infected the component containing user %s\n"%(split_root)
+
 	def approx_infection(self, quantity, version, epsilon):
 		num_infected = self.graph.approximate_infection(quantity, version, epsilon)
 		if num_infected is False:
@@ -69,6 +80,101 @@ class InteractiveRunner:
 		else:
 			print "Infected %s users with version %s\n"%(num_infected, version)
 
+	def multi_infection(self, arms):
+		results = self.graph.multi_arm_infection(arms)
+		if results is False:
+			print "Unable to find satisfactory components to infect "\
+			"for every version\n"
+		else:
+			for (version, quantity, epsilon), num_infected in zip(arms, results):
+				print "Infected %s users with version %s\n"%(num_infected, version)
+
+	def stratified_infection(self, quantity, version, epsilon):
+		num_infected = self.graph.stratified_infection(quantity, version, epsilon)
+		if num_infected is False:
+			print "Unable to find satisfactory components to infect "\
+			"for stratified infection\n"
+		else:
+			print "Infected %s users with version %s\n"%(num_infected, version)
+
+	def histogram(self):
+		histogram = self.graph.get_component_size_histogram()
+		if len(histogram) == 0:
+			print "No users currently in the graph\n"
+		else:
+			for size in sorted(histogram):
+				print "%s components of size %s"%(histogram[size], size)
+			print
+
+	def rollback(self, infection_id):
+		if infection_id is None:
+			infection_id = self.graph.last_infection_id
+		num_restored = self.graph.rollback(infection_id)
+		if num_restored is False:
+			print "No infection with id %s to roll back\n"%(infection_id)
+		else:
+			print "Rolled back infection %s, restoring %s users\n"%(infection_id, num_restored)
+
+	def version_counts(self):
+		counts = self.graph.version_counts()
+		if len(counts) == 0:
+			print "No users currently in the graph\n"
+		else:
+			for version in sorted(counts):
+				print "%s users with version %s"%(counts[version], version)
+			print
+
+	def stats(self, action, path=None):
+		if action == "on":
+			self.graph.enable_stats()
+			print "Started recording stats\n"
+		elif action == "off":
+			self.graph.disable_stats()
+			print "Stopped recording stats\n"
+		elif self.graph.stats is None:
+			print "Stats are not being recorded - run 'stats on' to start\n"
+		elif action == "reset":
+			self.graph.stats.reset()
+			print "Cleared recorded stats\n"
+		elif action == "show":
+			lines = self.graph.stats.report()
+			if len(lines) == 0:
+				print "No stats recorded yet\n"
+			else:
+				print "\n".join(lines) + "\n"
+		elif action == "export" and path is not None:
+			json_file_exporter(path)(self.graph.stats.export())
+			print "Wrote stats to %s\n"%(path)
+		else:
+			raise Exception("Unknown stats command %s"%(action))
+
+	def changes(self, action, capacity=None):
+		if action in ["on", "off"] and self.changes_subscription is not None:
+			self.changes_subscription.feed.unsubscribe(self.changes_subscription)
+			self.changes_subscription = None
+
+		if action == "on":
+			if capacity is None:
+				feed = self.graph.enable_change_feed()
+			else:
+				feed = self.graph.enable_change_feed(capacity)
+			self.changes_subscription = feed.subscribe()
+			print "Started recording changes\n"
+		elif action == "off":
+			self.graph.disable_change_feed()
+			print "Stopped recording changes\n"
+		elif self.changes_subscription is None:
+			print "Changes are not being recorded - run 'changes on' to start\n"
+		elif action == "show":
+			batch = self.changes_subscription.poll()
+			if batch.missed:
+				print "(%s changes were overwritten before they could be shown)"%(batch.missed)
+			for sequence, kind, first, second in batch:
+				print "%s: %s %s %s"%(sequence, KIND_NAMES[kind], first, second)
+			print "%s new changes\n"%(len(batch))
+		else:
+			raise Exception("Unknown changes command %s"%(action))
+
 	def exact_infection(self, quantity, version):
 		num_infected = self.graph.exact_infection(quantity, version)
 		if num_infected is False:
@@ -122,12 +228,50 @@ class InteractiveRunner:
 				version = int(args[2])
 				self.limited_infection(quantity, version)
 
+			elif command == "component_infection":
+				quantity = int(args[1])
+				version = int(args[2])
+				self.component_infection(quantity, version)
+
 			elif command == "approx_infection":
 				quantity = int(args[1])
 				version = int(args[2])
 				epsilon = int(args[3])
 				self.approx_infection(quantity, version, epsilon)
 
+			elif command == "multi_infection":
+				values = map(int, args[1:])
+				if len(values) == 0 or len(values) % 3 != 0:
+					raise Exception("Expected <version> <quantity> <epsilon> triples")
+				arms = [tuple(values[i:i + 3]) for i in range(0, len(values), 3)]
+				self.multi_infection(arms)
+
+			elif command == "stratified_infection":
+				quantity = int(args[1])
+				version = int(args[2])
+				epsilon = int(args[3])
+				self.stratified_infection(quantity, version, epsilon)
+
+			elif command == "histogram":
+				self.histogram()
+
+			elif command == "rollback":
+				infection_id = int(args[1]) if len(args) > 1 else None
+				self.rollback(infection_id)
+
+			elif command == "versions":
+				self.version_counts()
+
+			elif command == "stats":
+				action = args[1] if len(args) > 1 else "show"
+				path = args[2] if len(args) > 2 else None
+				self.stats(action, path)
+
+			elif command == "changes":
+				action = args[1] if len(args) > 1 else "show"
+				capacity = int(args[2]) if len(args) > 2 else None
+				self.changes(action, capacity)
+
 			elif command == "exact_infection":
 				quantity = int(args[1])
 				version = int(args[2])
@@ -0,0 +1,251 @@
+import random
+from collections import deque
+from itertools import chain, count
+
+class ComponentIndex:
+	def __init__(self, lookup_user):
+		'''
+		Incrementally tracks the connected components of a graph of users,
+		along with a histogram of component sizes.
+
+		Each component has a label, which stays the same as the component
+		grows or shrinks, and a root (the ID of one of its users), which can
+		be used for total infection.
+
+		Args:
+			lookup_user (function): Takes in a user ID and returns the
+			corresponding User object (or None). Used to walk adjacency
+			lists when a component might have been split.
+		'''
+
+		self.lookup_user = lookup_user
+
+		# Maps each user ID to the label of the component containing it
+		self.component_of = {}
+
+		# Maps each component label to the set of user IDs in the component
+		self.members = {}
+
+		# Maps each component size to a list of the labels of components
+		# with that size. Together with <positions> (which maps labels to
+		# their index in the list), this lets us add, remove and sample
+		# components of a given size in constant time.
+		self.by_size = {}
+		self.positions = {}
+
+		# Maps each component label to the ID of one of its users, which
+		# serves as the component's root for total infection
+		self.roots = {}
+
+		# Labels are assigned in order, so they're never reused
+		self.labels = count()
+
+	def _add_label(self, label):
+		size = len(self.members[label])
+		labels = self.by_size.setdefault(size, [])
+		self.positions[label] = len(labels)
+		labels.append(label)
+
+	def _remove_label(self, label):
+		size = len(self.members[label])
+		labels = self.by_size[size]
+		index = self.positions.pop(label)
+
+		# Swap the last label into the removed label's slot
+		last = labels.pop()
+		if last != label:
+			labels[index] = last
+			self.positions[last] = index
+		if len(labels) == 0:
+			del self.by_size[size]
+
+	def _new_component(self, root_id, members):
+		label = next(self.labels)
+		self.members[label] = members
+		self.roots[label] = root_id
+		for user_id in members:
+			self.component_of[user_id] = label
+		self._add_label(label)
+
+	def add_user(self, user_id):
+		'''
+		Adds a user to the index as a component of size 1.
+		'''
+
+		self._new_component(user_id, set([user_id]))
+
+	def merge(self, first_id, second_id):
+		'''
+		Merges the components containing the two specified users (e.g. after
+		an edge is added between them). Users from the smaller component are
+		relabelled, so the cost is proportional to its size.
+		'''
+
+		first_label = self.component_of[first_id]
+		second_label = self.component_of[second_id]
+		if first_label == second_label:
+			return
+
+		if len(self.members[first_label]) < len(self.members[second_label]):
+			first_label, second_label = second_label, first_label
+
+		self._remove_label(first_label)
+		self._remove_label(second_label)
+
+		moved = self.members.pop(second_label)
+		del self.roots[second_label]
+		for user_id in moved:
+			self.component_of[user_id] = first_label
+		self.members[first_label].update(moved)
+
+		self._add_label(first_label)
+
+	def split(self, first_id, second_id):
+		'''
+		Checks whether two users from the same component are still connected
+		(e.g. after the edge between them has been removed), splitting the
+		component in two if they aren't.
+
+		We search outwards from both users at once, alternately visiting one
+		user from each side. If the searches meet, the users are still
+		connected. Otherwise, the search that runs out of users first has
+		found the smaller of the two new components (give or take one
+		user's neighbors), and only that side is relabelled. Either way, the
+		cost is roughly proportional to the smaller side rather than the
+		whole component.
+		'''
+
+		label = self.component_of[first_id]
+		if first_id == second_id or self.component_of[second_id] != label:
+			return
+
+		first_side = (first_id, deque([first_id]), set([first_id]))
+		second_side = (second_id, deque([second_id]), set([second_id]))
+		sides = [(first_side, second_side), (second_side, first_side)]
+		while True:
+			for (start_id, bft_queue, visited), (other_id, other_queue, other_visited) in sides:
+				if len(bft_queue) == 0:
+					self._split_off(label, visited, start_id, other_id)
+					return
+
+				current_user = self.lookup_user(bft_queue.popleft())
+				for neighbor_id in chain(current_user.students, current_user.coached_by):
+					if neighbor_id in other_visited:
+						return
+					if neighbor_id not in visited:
+						visited.add(neighbor_id)
+						bft_queue.append(neighbor_id)
+
+	def _split_off(self, label, moved, root_id, remaining_id):
+		'''
+		Moves the users in <moved> (which must form a connected component) out
+		of the component with the specified label and into a new one rooted
+		at <root_id>. <remaining_id> is a user left behind in the old
+		component, which becomes its root if the old root was moved.
+		'''
+
+		self._remove_label(label)
+		self.members[label] -= moved
+		if self.roots[label] in moved:
+			self.roots[label] = remaining_id
+		self._add_label(label)
+		self._new_component(root_id, moved)
+
+	def remove_user(self, user_id, neighbor_ids):
+		'''
+		Removes a user from the index. The user's adjacency lists (and those
+		of its neighbors) must already have been updated, since the rest of
+		its component may have been split by the removal.
+
+		Args:
+			user_id (int): The ID of the user being removed.
+			neighbor_ids (list): The IDs of the users that were adjacent to
+			the removed user. Every new component contains at least one of
+			them, so we only need to check whether they're still connected
+			to each other (see split).
+		'''
+
+		label = self.component_of.pop(user_id)
+		self._remove_label(label)
+		self.members[label].remove(user_id)
+		neighbor_ids = [neighbor_id for neighbor_id in set(neighbor_ids)
+			if neighbor_id != user_id]
+		if len(neighbor_ids) == 0:
+			del self.members[label]
+			del self.roots[label]
+			return
+		if self.roots[label] == user_id:
+			self.roots[label] = neighbor_ids[0]
+		self._add_label(label)
+
+		# Every neighbor checked so far that's still in the original
+		# component is connected to <anchor>. If a split moves the anchor's
+		# side out, those neighbors went with it, so the next neighbor
+		# becomes the anchor.
+		anchor = neighbor_ids[0]
+		for neighbor_id in neighbor_ids[1:]:
+			if self.component_of[neighbor_id] != label:
+				continue
+			self.split(anchor, neighbor_id)
+			if self.component_of[anchor] != label:
+				anchor = neighbor_id
+
+	def partition(self, unvisited):
+		'''
+		Adds a component to the index for each connected component among the
+		specified (unindexed) users, found via breadth-first traversal.
+
+		Args:
+			unvisited (set): The IDs of the users to partition. Emptied by
+			this method.
+		'''
+
+		# Taking roots from a snapshot (rather than repeatedly calling
+		# next(iter(unvisited))) avoids rescanning the emptied slots at the
+		# start of the set each time, which is quadratic for many components
+		for root_id in list(unvisited):
+			if root_id not in unvisited:
+				continue
+			unvisited.remove(root_id)
+			component = set([root_id])
+			bft_queue = deque([root_id])
+
+			while len(bft_queue) != 0:
+				current_user = self.lookup_user(bft_queue.popleft())
+				for neighbor_id in current_user.students:
+					if neighbor_id in unvisited:
+						unvisited.remove(neighbor_id)
+						component.add(neighbor_id)
+						bft_queue.append(neighbor_id)
+				for neighbor_id in current_user.coached_by:
+					if neighbor_id in unvisited:
+						unvisited.remove(neighbor_id)
+						component.add(neighbor_id)
+						bft_queue.append(neighbor_id)
+
+			self._new_component(root_id, component)
+
+	def sizes(self):
+		'''
+		Returns a dict mapping the root of each component to its size.
+		'''
+
+		return dict((self.roots[label], len(members))
+			for label, members in self.members.iteritems())
+
+	def histogram(self):
+		'''
+		Returns a dict mapping each component size to the number of
+		components with that size.
+		'''
+
+		return dict((size, len(labels)) for size, labels in self.by_size.iteritems())
+
+	def sample(self, size, count):
+		'''
+		Returns the roots of <count> distinct components of the specified
+		size, chosen uniformly at random.
+		'''
+
+		labels = self.by_size.get(size, [])
+		return [self.roots[labels[i]] for i in random.sample(xrange(len(labels)), count)]
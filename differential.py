@@ -0,0 +1,418 @@
+import argparse
+import random
+import sys
+from importlib import import_module
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+from graph import *
+
+# Relative frequencies of each kind of operation in random sequences.
+# stratified_infection is left out since it samples components at random.
+OPERATION_WEIGHTS = [
+	("create_user", 25),
+	("add_edge", 30),
+	("remove_edge", 10),
+	("remove_user", 5),
+	("total_infection", 6),
+	("limited_infection_simple", 4),
+	("limited_infection_components", 4),
+	("approximate_infection", 6),
+	("exact_infection", 5),
+	("multi_arm_infection", 5)
+]
+
+# Versions used by random sequences
+MAX_VERSION = 4
+
+# Positions of the arguments of each operation that are user IDs
+USER_ID_POSITIONS = {
+	"add_edge": [1, 2],
+	"remove_edge": [1, 2],
+	"remove_user": [1],
+	"total_infection": [1]
+}
+
+def instrumented_graph():
+	'''
+	Returns a Graph with instrumentation enabled, which should behave
+	exactly like one without.
+	'''
+
+	graph = Graph()
+	graph.enable_stats()
+	return graph
+
+# Candidate engines that can be named on the command line. Other engines
+# can be given as <module>:<callable>, where the callable returns an object
+# with the same interface as Graph.
+ENGINES = {
+	"graph": Graph,
+	"instrumented": instrumented_graph
+}
+
+def load_engine(name):
+	'''
+	Returns the factory for the engine with the specified name (see ENGINES).
+	'''
+
+	if name in ENGINES:
+		return ENGINES[name]
+	module_name, separator, attribute = name.partition(":")
+	if not separator:
+		raise ValueError("Unknown engine %s"%(name))
+	return getattr(import_module(module_name), attribute)
+
+def random_operations(seed, steps):
+	'''
+	Generates a random sequence of Graph operations. User IDs are drawn from
+	the IDs that will have been assigned by the preceding create_user
+	operations (plus one that won't), so some operations refer to removed or
+	nonexistent users. The exception is the root of total_infection, which
+	Graph requires to exist, so it's drawn from the users that haven't been
+	removed.
+
+	Returns:
+		A list of tuples of the form (method_name, arg1, arg2, ...)
+	'''
+
+	rng = random.Random(seed)
+	names = []
+	for name, weight in OPERATION_WEIGHTS:
+		names.extend([name] * weight)
+
+	operations = []
+	num_created = 0
+	live_ids = []
+	for i in range(steps):
+		name = rng.choice(names)
+		user_id = lambda: rng.randint(1, num_created + 1)
+		version = lambda: rng.randint(1, MAX_VERSION)
+		quantity = lambda: rng.randint(0, num_created + 2)
+
+		if name == "create_user":
+			operations.append((name, version()))
+			num_created += 1
+			live_ids.append(num_created)
+		elif name in ["add_edge", "remove_edge"]:
+			operations.append((name, user_id(), user_id()))
+		elif name == "remove_user":
+			removed_id = user_id()
+			operations.append((name, removed_id))
+			if removed_id in live_ids:
+				live_ids.remove(removed_id)
+		elif name == "total_infection":
+			if len(live_ids) == 0:
+				continue
+			operations.append((name, rng.choice(live_ids), version()))
+		elif name == "approximate_infection":
+			operations.append((name, quantity(), version(), rng.randint(0, 3)))
+		elif name == "multi_arm_infection":
+			arms = tuple((version(), quantity(), rng.randint(0, 3))
+				for arm in range(rng.randint(1, 3)))
+			operations.append((name, arms))
+		else:
+			operations.append((name, quantity(), version()))
+	return operations
+
+def is_applicable(reference, operation):
+	'''
+	Returns whether an operation can be applied given the reference engine's
+	current state. Graph doesn't check that infection roots exist, so we
+	skip infections from nonexistent roots (which shrinking can create by
+	removing the create_user operations that assigned them).
+	'''
+
+	if operation[0] == "total_infection":
+		return operation[1] in reference.users
+	return True
+
+def apply_operation(engine, operation, catch=True):
+	'''
+	Applies an operation to an engine and returns a comparable description
+	of its result. If <catch> is True, an exception raised by the engine is
+	described too; otherwise it's propagated.
+	'''
+
+	name = operation[0]
+	args = list(operation[1:])
+	if name == "multi_arm_infection":
+		args[0] = list(args[0])
+
+	try:
+		result = getattr(engine, name)(*args)
+	except Exception as e:
+		if not catch:
+			raise
+		return "raised %s"%(type(e).__name__)
+
+	# The split component is identified by an arbitrary user in it
+	if name == "limited_infection_components":
+		return result[0]
+	if name == "create_user":
+		return result.id
+	return result
+
+def bfs_component_sizes(graph):
+	'''
+	Returns a sorted list of the sizes of a Graph's connected components,
+	found by breadth-first traversal of its adjacency lists.
+	'''
+
+	visited = set()
+	sizes = []
+	for user_id in graph.users:
+		if user_id not in visited:
+			sizes.append(graph.component_size(user_id, visited))
+	return sorted(sizes)
+
+def compare(reference, candidate, strict):
+	'''
+	Compares the state of two engines after the same operations.
+
+	Args:
+		reference (Graph): The reference engine.
+		candidate (object): The engine being tested.
+		strict (bool): Whether every user must have the same version in
+		both engines. Engines that break ties between equally good choices
+		of component differently may only be compared non-strictly.
+
+	Returns:
+		A description of the first difference found, or None.
+	'''
+
+	expected_sizes = bfs_component_sizes(reference)
+	for name, engine in [("reference", reference), ("candidate", candidate)]:
+		sizes = sorted(engine.get_component_sizes().values())
+		if sizes != expected_sizes:
+			return "%s component sizes %s, expected %s"%(name, sizes, expected_sizes)
+
+		# The version index must agree with the users themselves
+		counts = {}
+		for user in engine.users.values():
+			counts[user.version] = counts.get(user.version, 0) + 1
+		if hasattr(engine, "version_counts") and engine.version_counts() != counts:
+			return "%s version counts %s, expected %s"%(name,
+				engine.version_counts(), counts)
+
+	if strict:
+		expected_versions = dict((user_id, user.version)
+			for user_id, user in reference.users.iteritems())
+		versions = dict((user_id, user.version)
+			for user_id, user in candidate.users.iteritems())
+		if versions != expected_versions:
+			return "user versions %s, expected %s"%(versions, expected_versions)
+	return None
+
+def run_operations(operations, candidate_factory, strict=True):
+	'''
+	Applies a sequence of operations to a reference Graph and a candidate
+	engine, comparing them after every step. Operations that aren't
+	applicable (see is_applicable) are skipped. The reference must never
+	raise an exception, since then there'd be nothing to compare the
+	candidate against, so that's reported as a failure too.
+
+	Returns:
+		None if the engines agreed throughout, otherwise a tuple of the form
+		(step, message) describing the first disagreement.
+	'''
+
+	reference = Graph()
+	candidate = candidate_factory()
+	for step, operation in enumerate(operations):
+		if not is_applicable(reference, operation):
+			continue
+
+		# Engines may pick components at random, so give them the same
+		# random numbers
+		state = random.getstate()
+		try:
+			expected = apply_operation(reference, operation, catch=False)
+		except Exception as e:
+			return (step, "reference raised %s on %s"%(type(e).__name__, operation))
+		random.setstate(state)
+		result = apply_operation(candidate, operation)
+
+		if result != expected:
+			return (step, "%s returned %s, expected %s"%(operation, result, expected))
+		message = compare(reference, candidate, strict)
+		if message is not None:
+			return (step, "after %s: %s"%(operation, message))
+	return None
+
+def remove_operations(operations, fails):
+	'''
+	Removes as many operations as possible from a failing sequence while
+	keeping it failing, first in large chunks and then one at a time.
+	'''
+
+	chunk_size = len(operations) / 2
+	while chunk_size >= 1:
+		start = 0
+		while start < len(operations):
+			attempt = operations[:start] + operations[start + chunk_size:]
+			if fails(attempt):
+				operations = attempt
+			else:
+				start += chunk_size
+		chunk_size /= 2
+	return operations
+
+def smaller_values(value):
+	return [smaller for smaller in sorted(set([0, 1, value / 2, value - 1]))
+		if 0 <= smaller < value]
+
+def rename_user(operations, old_id, new_id):
+	'''
+	Returns a copy of a sequence of operations in which every reference to
+	one user ID is replaced with another.
+	'''
+
+	renamed = []
+	for operation in operations:
+		positions = USER_ID_POSITIONS.get(operation[0], [])
+		renamed.append(tuple(new_id if position in positions and value == old_id else value
+			for position, value in enumerate(operation)))
+	return renamed
+
+def lower_arguments(operations, fails):
+	'''
+	Replaces integer arguments in a failing sequence with smaller ones
+	wherever it keeps failing. User IDs are replaced throughout the sequence
+	at once, which lets remove_operations drop the create_user operations
+	that assigned the original IDs.
+	'''
+
+	user_ids = set()
+	for operation in operations:
+		for position in USER_ID_POSITIONS.get(operation[0], []):
+			user_ids.add(operation[position])
+	for user_id in sorted(user_ids):
+		for smaller in smaller_values(user_id):
+			attempt = rename_user(operations, user_id, smaller)
+			if fails(attempt):
+				operations = attempt
+				break
+
+	for i in range(len(operations)):
+		positions = USER_ID_POSITIONS.get(operations[i][0], [])
+		for position in range(1, len(operations[i])):
+			value = operations[i][position]
+			if position in positions or not isinstance(value, int):
+				continue
+			for smaller in smaller_values(value):
+				operation = operations[i][:position] + (smaller,) + operations[i][position + 1:]
+				attempt = operations[:i] + [operation] + operations[i + 1:]
+				if fails(attempt):
+					operations = attempt
+					break
+	return operations
+
+def shrink(operations, candidate_factory, strict=True):
+	'''
+	Shrinks a failing sequence of operations by alternately removing
+	operations and lowering their arguments until neither makes progress.
+
+	Returns:
+		A list of operations that still makes the engines disagree.
+	'''
+
+	fails = lambda attempt: run_operations(attempt, candidate_factory, strict) is not None
+	operations = list(operations)
+	while True:
+		shrunk = lower_arguments(remove_operations(operations, fails), fails)
+		if shrunk == operations:
+			return operations
+		operations = shrunk
+
+def check_seed(args):
+	'''
+	Runs a random sequence generated from a seed, shrinking it if it fails.
+	Meant to be run in a worker process.
+
+	Args:
+		args (tuple): A tuple of the form (seed, steps, engine_name, strict)
+
+	Returns:
+		None if the engines agreed, otherwise a tuple of the form
+		(seed, operations, step, message) describing a minimal failing
+		sequence.
+	'''
+
+	seed, steps, engine_name, strict = args
+	candidate_factory = load_engine(engine_name)
+	random.seed(seed)
+	operations = random_operations(seed, steps)
+	if run_operations(operations, candidate_factory, strict) is None:
+		return None
+
+	operations = shrink(operations, candidate_factory, strict)
+	step, message = run_operations(operations, candidate_factory, strict)
+	return (seed, operations, step, message)
+
+def run(seeds, steps, engine_name, strict=True, workers=None, time_limit=None):
+	'''
+	Checks many seeds in parallel worker processes.
+
+	Args:
+		seeds (list): The seeds to check.
+		steps (int): The number of operations generated for each seed.
+		engine_name (str): The candidate engine (see load_engine).
+		strict (bool): See compare.
+		workers (int): The number of worker processes. Defaults to the
+		number of CPUs.
+		time_limit (float): Stop checking new seeds after this many
+		seconds, or None to check every seed.
+
+	Returns:
+		A tuple of the form (num_checked, failures), where failures is a
+		list of the results of check_seed for failing seeds.
+	'''
+
+	start = default_timer()
+	pool = Pool(processes=workers or cpu_count())
+	failures = []
+	num_checked = 0
+	try:
+		tasks = [(seed, steps, engine_name, strict) for seed in seeds]
+		for failure in pool.imap_unordered(check_seed, tasks):
+			num_checked += 1
+			if failure is not None:
+				failures.append(failure)
+			if time_limit is not None and default_timer() - start > time_limit:
+				break
+	finally:
+		pool.terminate()
+		pool.join()
+	return (num_checked, failures)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="Checks that a Graph engine "\
+		"agrees with the reference Graph on random sequences of operations.")
+	parser.add_argument("--engine", default="graph",
+		help="Engine to test: one of %s, or <module>:<callable>"%(", ".join(sorted(ENGINES))))
+	parser.add_argument("--seeds", type=int, default=1000,
+		help="Number of random sequences to check")
+	parser.add_argument("--first-seed", type=int, default=0)
+	parser.add_argument("--steps", type=int, default=200,
+		help="Number of operations in each sequence")
+	parser.add_argument("--workers", type=int, default=None)
+	parser.add_argument("--time-limit", type=float, default=None,
+		help="Stop checking new seeds after this many seconds")
+	parser.add_argument("--loose", action="store_true",
+		help="Don't require every user to end up with the same version")
+	args = parser.parse_args(argv)
+
+	seeds = range(args.first_seed, args.first_seed + args.seeds)
+	num_checked, failures = run(seeds, args.steps, args.engine, not args.loose,
+		args.workers, args.time_limit)
+
+	for seed, operations, step, message in failures:
+		print "Seed %s fails at step %s: %s"%(seed, step, message)
+		print "Minimal sequence:"
+		for operation in operations:
+			print "    %s"%(operation,)
+	print "Checked %s seeds, %s failed"%(num_checked, len(failures))
+	return 1 if failures else 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,146 @@
+import numpy as np
+
+# Shapes of graph we know how to generate (see component_sizes)
+SHAPES = ["uniform", "power_law", "classroom"]
+
+class SyntheticGraph:
+	def __init__(self, user_ids, versions, coach_ids, student_ids, component_of, sizes):
+		'''
+		A randomly generated set of users and coaching relationships, along
+		with the connected component that each user belongs to. All
+		attributes are NumPy arrays.
+
+		Args:
+			user_ids (array): The ID of each user.
+			versions (array): The version of each user in user_ids.
+			coach_ids (array): The coach in each coaching relationship.
+			student_ids (array): The student in each coaching relationship.
+			component_of (array): The index of the connected component
+			containing each user in user_ids.
+			sizes (array): The size of each connected component.
+		'''
+
+		self.user_ids = user_ids
+		self.versions = versions
+		self.coach_ids = coach_ids
+		self.student_ids = student_ids
+		self.component_of = component_of
+		self.sizes = sizes
+
+	def members(self, component):
+		'''
+		Returns an array of the IDs of the users in the connected component
+		with the specified index.
+		'''
+
+		return self.user_ids[self.component_of == component]
+
+	def load(self, graph, edges=True):
+		'''
+		Adds the generated users (and, optionally, their coaching
+		relationships) to a Graph in bulk.
+
+		Returns:
+			The result of Graph.bulk_load.
+		'''
+
+		coach_ids = self.coach_ids.tolist() if edges else []
+		student_ids = self.student_ids.tolist() if edges else []
+		return graph.bulk_load(self.user_ids.tolist(), self.versions.tolist(),
+			coach_ids, student_ids)
+
+def component_sizes(num_users, shape, rng, max_size=100):
+	'''
+	Splits <num_users> users into connected components with sizes drawn
+	from the specified distribution.
+
+	Args:
+		num_users (int): The total number of users.
+		shape (str): One of "uniform" (sizes drawn uniformly from
+		[1, max_size]), "power_law" (many small components and a few very
+		large ones) or "classroom" (sizes clustered around that of a
+		typical class).
+		rng (RandomState): The random number generator to draw sizes from.
+		max_size (int): The largest component size for uniform graphs.
+
+	Returns:
+		An array of component sizes that sum up to num_users.
+	'''
+
+	if shape not in SHAPES:
+		raise ValueError("Unknown graph shape %s"%(shape))
+
+	if num_users == 0:
+		return np.zeros(0, dtype=np.int64)
+
+	batches = []
+	total = 0
+	while total < num_users:
+		# Draw roughly enough sizes to cover the remaining users
+		count = max(16, (num_users - total) / 8)
+		if shape == "uniform":
+			batch = rng.randint(1, max_size + 1, size=count)
+		elif shape == "power_law":
+			batch = np.floor(rng.pareto(1.5, size=count) + 1).astype(np.int64)
+		else:
+			batch = np.maximum(1, rng.normal(30, 8, size=count).astype(np.int64))
+		batches.append(batch)
+		total += batch.sum()
+
+	sizes = np.concatenate(batches).astype(np.int64)
+	ends = np.cumsum(sizes)
+	last = np.searchsorted(ends, num_users)
+	sizes = sizes[:last + 1]
+	sizes[last] -= ends[last] - num_users
+	return sizes
+
+def generate(num_users, shape="uniform", seed=0, versions=(1,), weights=None,
+	first_id=1, max_size=100):
+	'''
+	Generates a graph of <num_users> users whose connected components have
+	sizes drawn from the specified distribution, using a seeded random
+	number generator so that the same arguments always give the same graph.
+
+	User IDs are shuffled so that connected components aren't made up of
+	consecutive IDs. Classroom components consist of a single coach who
+	coaches every other user in the component; other components are random
+	spanning trees.
+
+	Args:
+		num_users (int): The total number of users.
+		shape (str): The distribution of component sizes (see
+		component_sizes).
+		seed (int): The seed for the random number generator.
+		versions (tuple): The versions to assign to users.
+		weights (tuple): The probability of assigning each version, or None
+		to pick versions uniformly.
+		first_id (int): The smallest user ID to assign.
+		max_size (int): The largest component size for uniform graphs.
+
+	Returns:
+		A SyntheticGraph.
+	'''
+
+	rng = np.random.RandomState(seed)
+	sizes = component_sizes(num_users, shape, rng, max_size)
+	starts = np.cumsum(sizes) - sizes
+
+	# Users are laid out component by component before we shuffle their IDs
+	component_of = np.repeat(np.arange(len(sizes)), sizes)
+	position = np.arange(num_users) - starts[component_of]
+
+	# Connect every user but the first in each component to a coach who
+	# comes before it in the same component
+	is_student = position > 0
+	if shape == "classroom":
+		coach_position = np.zeros(num_users, dtype=np.int64)
+	else:
+		coach_position = (rng.random_sample(num_users) * position).astype(np.int64)
+	coaches = (starts[component_of] + coach_position)[is_student]
+	students = np.arange(num_users)[is_student]
+
+	ids = rng.permutation(num_users).astype(np.int64) + first_id
+	user_versions = rng.choice(np.asarray(versions), size=num_users, p=weights)
+
+	return SyntheticGraph(ids, user_versions, ids[coaches], ids[students],
+		component_of, sizes)
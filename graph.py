@@ -1,8 +1,72 @@
-from collections import deque
+import gc
+from collections import deque, OrderedDict
+from functools import wraps
+from itertools import chain, izip, permutations
 from user import User 
+from components import ComponentIndex
+from undo import UndoLog
+from instrumentation import Stats
+from changefeed import ChangeFeed, DEFAULT_CAPACITY, CREATE_USER, REMOVE_USER, \
+	ADD_EDGE, REMOVE_EDGE, SET_VERSION, CLEAR
+
+# Graph methods that are timed when instrumentation is enabled (see
+# Graph.enable_stats). lookup_user is left out since it's called once per
+# user visited by every traversal.
+INSTRUMENTED_METHODS = [
+	"clear", "add_edge", "remove_edge", "create_user", "bulk_load",
+	"remove_user", "set_version", "users_with_version", "version_counts",
+	"rollback", "discard_undo_log", "total_infection",
+	"limited_infection_simple", "limited_infection_components",
+	"component_size", "get_component_sizes", "get_component_sizes_tuples",
+	"total_infection_multiple", "subsets_to_infect", "extract_solution",
+	"approximate_infection", "reachable_sums", "exact_multi_arm_assignment",
+	"search_multi_arm_assignment", "multi_arm_infection",
+	"get_component_size_histogram", "stratified_quotas", "histogram_subset",
+	"stratified_infection", "exact_infection"
+]
+
+# multi_arm_infection searches exactly when the number of components times
+# the product of (target + epsilon + 1) over the arms is at most this
+MULTI_ARM_EXACT_CELLS = 2000000
+
+# The most candidate sums the multi-arm heuristic tries before giving up
+MULTI_ARM_MAX_ATTEMPTS = 64
+
+# Default number of infections that can be rolled back. Older undo logs are
+# discarded as new infections are run.
+MAX_UNDO_LOGS = 32
+
+def records_infection(method):
+	'''
+	Decorates a Graph method that changes user versions so that all of the
+	changes it makes are recorded in a single undo log, which is stored under
+	a new infection ID (see Graph.rollback). Calls made from within another
+	decorated method are recorded in the outer method's log.
+
+	Every call gets an infection ID, but logs of calls that changed nothing
+	aren't stored, and only the newest <max_undo_logs> logs are kept.
+	'''
+
+	@wraps(method)
+	def wrapper(self, *args, **kwargs):
+		if self.current_undo_log is not None:
+			return method(self, *args, **kwargs)
+
+		self.current_undo_log = UndoLog()
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			infection_id = self.next_infection_id
+			if len(self.current_undo_log) != 0:
+				self._store_undo_log(infection_id, self.current_undo_log)
+			self.last_infection_id = infection_id
+			self.next_infection_id += 1
+			self.current_undo_log = None
+	return wrapper
+
 
 class Graph:
-	def __init__(self, users=None):
+	def __init__(self, users=None, max_undo_logs=MAX_UNDO_LOGS):
 		'''
 		Manages all users and their relationships to each other.
 
@@ -10,6 +74,8 @@ class Graph:
 			users (dict): A dict mapping integer user IDs to user objects.
 			We use integer user IDs to reference users so that we can
 			easily adjust our system to work with a database.
+			max_undo_logs (int): The number of most recent infections that
+			can be rolled back, or None to keep every undo log.
 		'''
 
 		# ID to be assigned to the next user created
@@ -23,6 +89,108 @@ class Graph:
 		# Whether or not we need to update our cache of component sizes
 		self.update_cache = True
 
+		# Tracks connected components and a histogram of their sizes as
+		# the graph changes
+		self.components = ComponentIndex(self.lookup_user)
+		self.components.partition(set(self.users))
+
+		# A dict mapping each version to the set of IDs of users with
+		# that version
+		self.version_users = {}
+		for user in self.users.values():
+			self.version_users.setdefault(user.version, set()).add(user.id)
+
+		# A dict mapping infection IDs to the UndoLogs of their changes
+		# (oldest first), and the log for the infection currently in
+		# progress (if any)
+		self.undo_logs = OrderedDict()
+		self.max_undo_logs = max_undo_logs
+		self.current_undo_log = None
+		self.next_infection_id = 1
+		self.last_infection_id = None
+
+		# Instrumentation (see enable_stats); None while disabled
+		self.stats = None
+
+		# Feed of changes to the graph (see enable_change_feed); None
+		# while disabled
+		self.change_feed = None
+
+	def enable_change_feed(self, capacity=DEFAULT_CAPACITY):
+		'''
+		Starts appending a record to a ChangeFeed each time a user or edge
+		is added or removed, or a user's version changes, so that other
+		systems can subscribe to changes instead of rescanning the graph.
+
+		Args:
+			capacity (int): The number of records kept by the feed.
+
+		Returns:
+			The ChangeFeed.
+		'''
+
+		if self.change_feed is None:
+			self.change_feed = ChangeFeed(capacity)
+		return self.change_feed
+
+	def disable_change_feed(self):
+		self.change_feed = None
+
+	def enable_stats(self, stats=None):
+		'''
+		Starts recording call counts, wall times, work counters and peak
+		structure sizes for the methods in INSTRUMENTED_METHODS.
+
+		Instrumented methods are shadowed by timing wrappers on this Graph
+		object, so while instrumentation is disabled they're called directly
+		and cost nothing extra. Counters are accumulated in local variables
+		and recorded once per call.
+
+		Args:
+			stats (Stats): The Stats object to record to. Defaults to a new one.
+
+		Returns:
+			The Stats object being recorded to.
+		'''
+
+		self.disable_stats()
+		self.stats = Stats() if stats is None else stats
+		for name in INSTRUMENTED_METHODS:
+			method = getattr(self, name)
+			setattr(self, name, self.stats.timed(name, method, self._record_peaks))
+		return self.stats
+
+	def disable_stats(self):
+		'''
+		Stops recording stats and removes the timing wrappers.
+		'''
+
+		for name in INSTRUMENTED_METHODS:
+			self.__dict__.pop(name, None)
+		self.stats = None
+
+	def _record_peaks(self):
+		self.stats.record_peak("users", len(self.users))
+		self.stats.record_peak("components", len(self.components.members))
+		self.stats.record_peak("versions", len(self.version_users))
+		self.stats.record_peak("undo_logs", len(self.undo_logs))
+		if self.last_infection_id in self.undo_logs:
+			self.stats.record_peak("undo_log_entries",
+				len(self.undo_logs[self.last_infection_id]))
+
+	def clear(self):
+		'''
+		Removes all users from the graph.
+		'''
+
+		self.users = {}
+		self.components = ComponentIndex(self.lookup_user)
+		self.version_users = {}
+		self.undo_logs = OrderedDict()
+		self.update_cache = True
+		if self.change_feed is not None:
+			self.change_feed.append(CLEAR, 0, 0)
+
 	def add_edge(self, coach_id, student_id):
 		'''
 		Adds a coaching relationship between two user objects if it does not
@@ -45,12 +213,19 @@ class Graph:
 		if student is None or coach is None:
 			return False
 
+		added = False
 		if coach_id not in student.coached_by:
 			student.coached_by.add(coach_id)
-			self.update_cache = True
+			added = True
 		if student_id not in coach.students:
 			coach.students.add(student_id)
+			added = True
+
+		if added:
 			self.update_cache = True
+			self.components.merge(coach_id, student_id)
+			if self.change_feed is not None:
+				self.change_feed.append(ADD_EDGE, coach_id, student_id)
 		return True
 
 
@@ -76,12 +251,22 @@ class Graph:
 		if student is None or coach is None:
 			return False
 
+		removed = False
 		if coach_id in student.coached_by:
 			student.coached_by.remove(coach_id)
-			self.update_cache = True
+			removed = True
 		if student_id in coach.students:
 			coach.students.remove(student_id)
+			removed = True
+
+		# The users may still be adjacent if each coaches the other
+		adjacent = student_id in coach.coached_by or coach_id in student.students
+		if removed:
 			self.update_cache = True
+			if not adjacent:
+				self.components.split(coach_id, student_id)
+			if self.change_feed is not None:
+				self.change_feed.append(REMOVE_EDGE, coach_id, student_id)
 		return True
 
 
@@ -110,19 +295,98 @@ class Graph:
 			version (int): The site version of the new user.
 			students (set): The IDs of users who are students of the new user
 			coached_by (set): The IDs of users who coach the new user
+			(IDs of users that don't exist are ignored)
 		Returns:
 			The created user.
 		'''
 
 		new_id = self.next_user_id
-		new_user = User(version, new_id, students, coached_by)
+		new_user = User(version, new_id)
 		self.users[new_id] = new_user
 
 		self.next_user_id += 1		
 		self.update_cache = True
 
+		self.components.add_user(new_id)
+		self.version_users.setdefault(version, set()).add(new_id)
+		if self.change_feed is not None:
+			self.change_feed.append(CREATE_USER, new_id, version)
+
+		# Adding relationships through add_edge keeps both users' adjacency
+		# lists, the components and the change feed consistent
+		for student_id in students or ():
+			self.add_edge(new_id, student_id)
+		for coach_id in coached_by or ():
+			self.add_edge(coach_id, new_id)
+
 		return new_user
 			
+	def bulk_load(self, user_ids, versions, coach_ids=(), student_ids=()):
+		'''
+		Adds many users and coaching relationships to the graph at once. This
+		is much faster than calling create_user and add_edge repeatedly, since
+		connected components are only computed once at the end. Fails without
+		changing the graph if any of the user IDs is already in use, any
+		relationship refers to a user that doesn't exist, or the lists in
+		either pair (user_ids and versions, coach_ids and student_ids) differ
+		in length.
+
+		Args:
+			user_ids (list): The IDs of the new users.
+			versions (list): The version of each new user.
+			coach_ids (list): The coach in each new coaching relationship.
+			student_ids (list): The student in each new coaching relationship
+			(so the ith relationship is between coach_ids[i] and
+			student_ids[i]).
+
+		Returns:
+			True on success, False on failure.
+		'''
+
+		if len(versions) != len(user_ids) or len(coach_ids) != len(student_ids):
+			return False
+		new_ids = set(user_ids)
+		if len(new_ids) != len(user_ids) or not new_ids.isdisjoint(self.users):
+			return False
+		for user_id in chain(coach_ids, student_ids):
+			if user_id not in new_ids and user_id not in self.users:
+				return False
+
+		# We allocate a lot of objects here without creating any reference
+		# cycles, so pause the garbage collector rather than have it
+		# repeatedly scan everything we've allocated so far
+		gc_was_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			for user_id, version in izip(user_ids, versions):
+				self.users[user_id] = User(version, user_id)
+				self.version_users.setdefault(version, set()).add(user_id)
+
+			for coach_id, student_id in izip(coach_ids, student_ids):
+				self.users[coach_id].students.add(student_id)
+				self.users[student_id].coached_by.add(coach_id)
+
+			# The traversal only walks new users, so merge in any components
+			# that new users were connected to afterwards
+			self.components.partition(set(new_ids))
+			for coach_id, student_id in izip(coach_ids, student_ids):
+				if coach_id not in new_ids or student_id not in new_ids:
+					self.components.merge(coach_id, student_id)
+		finally:
+			if gc_was_enabled:
+				gc.enable()
+
+		if self.change_feed is not None:
+			for user_id, version in izip(user_ids, versions):
+				self.change_feed.append(CREATE_USER, user_id, version)
+			for coach_id, student_id in izip(coach_ids, student_ids):
+				self.change_feed.append(ADD_EDGE, coach_id, student_id)
+
+		if len(user_ids) != 0:
+			self.next_user_id = max(self.next_user_id, max(user_ids) + 1)
+		self.update_cache = True
+		return True
+
 	def remove_user(self, user_id):
 		'''
 		Removes the user with the specified ID from the graph. Fails
@@ -147,10 +411,119 @@ class Graph:
 
 			# Remove user from graph
 			self.users.pop(user.id)
+			self.components.remove_user(user.id, list(user.students | user.coached_by))
+			self._discard_version(user)
+			if self.change_feed is not None:
+				self.change_feed.append(REMOVE_USER, user.id, 0)
 			self.update_cache = True
 			return True
 		return False
 
+	def _discard_version(self, user):
+		version_users = self.version_users[user.version]
+		version_users.remove(user.id)
+		if len(version_users) == 0:
+			del self.version_users[user.version]
+
+	def _set_version(self, user, version):
+		'''
+		Sets the version of a User object, keeping the version index up to
+		date and recording the change in the current undo log (if any).
+		'''
+
+		if user.version == version:
+			return
+		if self.current_undo_log is not None:
+			self.current_undo_log.record(user.id, user.version)
+		self._discard_version(user)
+		self.version_users.setdefault(version, set()).add(user.id)
+		user.version = version
+		if self.change_feed is not None:
+			self.change_feed.append(SET_VERSION, user.id, version)
+
+	def set_version(self, user_id, version):
+		'''
+		Sets the version of the user with the specified ID. User versions
+		should only be changed through the Graph so that its index of
+		versions stays up to date.
+
+		Args:
+			user_id (int): The ID of the user whose version is being set.
+			version (int): The user's new version.
+
+		Returns:
+			True on success, False on failure (no such user exists)
+		'''
+
+		user = self.lookup_user(user_id)
+		if user is None:
+			return False
+		self._set_version(user, version)
+		return True
+
+	def users_with_version(self, version):
+		'''
+		Returns the set of IDs of users with the specified version. The
+		returned set should not be modified.
+		'''
+
+		return self.version_users.get(version, set())
+
+	def version_counts(self):
+		'''
+		Returns a dict mapping each version to the number of users with
+		that version.
+		'''
+
+		return dict((version, len(user_ids)) for version, user_ids in self.version_users.iteritems())
+
+	def rollback(self, infection_id):
+		'''
+		Restores the previous versions of the users changed by the specified
+		infection, in time proportional to the number of users changed.
+		Users that have since been removed from the graph are skipped. An
+		infection can only be rolled back once.
+
+		Args:
+			infection_id (int): The ID of the infection to roll back, e.g.
+			last_infection_id after the infection was run.
+
+		Returns:
+			The number of users restored, or False if there is no infection
+			with the specified ID to roll back (including infections that
+			changed nothing, and ones whose undo logs have been discarded).
+		'''
+
+		undo_log = self.undo_logs.pop(infection_id, None)
+		if undo_log is None:
+			return False
+
+		num_restored = 0
+		for user_id, previous_version in undo_log.entries():
+			user = self.lookup_user(user_id)
+			if user is not None:
+				self._set_version(user, previous_version)
+				num_restored += 1
+		return num_restored
+
+	def discard_undo_log(self, infection_id):
+		'''
+		Frees the undo log of the specified infection, which can then no
+		longer be rolled back.
+
+		Returns:
+			True on success, False if there was no such undo log.
+		'''
+
+		return self.undo_logs.pop(infection_id, None) is not None
+
+	def _store_undo_log(self, infection_id, undo_log):
+		if self.max_undo_logs is not None and self.max_undo_logs <= 0:
+			return
+		self.undo_logs[infection_id] = undo_log
+		while self.max_undo_logs is not None and len(self.undo_logs) > self.max_undo_logs:
+			self.undo_logs.popitem(last=False)
+
 	def invert_dict(self, dictionary):
 		'''
 		Inverts a dictionary.
@@ -197,11 +570,19 @@ class Graph:
 		visited = set() if visited is None else visited
 		visited.add(root_id)
 		bft_queue = deque([root_id])
+		initially_infected = num_infected
+
+		# Edges are only counted when stats are enabled, since this loop runs
+		# once per infected user
+		counting = self.stats is not None
+		edges_visited = 0
 
 		while len(bft_queue) != 0 and condition(num_infected):
 			current_user = self.lookup_user(bft_queue.popleft())
-			current_user.version = version
+			self._set_version(current_user, version)
 			num_infected += 1
+			if counting:
+				edges_visited += len(current_user.students) + len(current_user.coached_by)
 			for student_id in current_user.students:
 				if student_id not in visited: 
 					bft_queue.append(student_id)
@@ -212,8 +593,12 @@ class Graph:
 					bft_queue.append(coach_id)
 					visited.add(coach_id)
 
+		if counting:
+			self.stats.add("nodes_visited", num_infected - initially_infected)
+			self.stats.add("edges_visited", edges_visited)
 		return (num_infected, visited)
 
+	@records_infection
 	def total_infection(self, root_id, version):
 		'''
 		Totally infects the connected component containing the user with ID <root_id>.
@@ -229,6 +614,7 @@ class Graph:
 		condition = lambda num_infected : True
 		return self.infect_while_condition(root_id, version, condition)[0]
 
+	@records_infection
 	def limited_infection_simple(self, target_quantity, version):
 		'''
 		A simple version of limited infection in which we attempt to totally 
@@ -254,6 +640,56 @@ class Graph:
 				break
 		return num_infected
 
+	@records_infection
+	def limited_infection_components(self, target_quantity, version):
+		'''
+		A version of limited infection driven by the component sizes from
+		get_component_sizes. We greedily totally infect the largest components
+		that still fit in the remaining quantity, then partially infect exactly
+		one component (the smallest one that is too large to fit) to make up
+		the remainder. Since component sizes are read from the component
+		index (see ComponentIndex) rather than found by traversal, the only
+		users visited are the ones that end up infected.
+
+		Args:
+			target_quantity (int): The number of users to infect.
+			version (int): The version used to infect users.
+
+		Returns:
+			A tuple of the form (num_infected, split_root). split_root is the
+			ID of the user at which we began infecting the partially infected
+			component, or None if no component was split.
+		'''
+
+		remaining = target_quantity
+		num_infected = 0
+		split_root = None
+		split_size = None
+
+		# Components are sorted in decreasing order of size, so a component
+		# skipped here is also too large for any later (smaller) remainder
+		for user_id, size in self.get_component_sizes_tuples():
+			if remaining == 0:
+				break
+			if size <= remaining:
+				num_infected += self.total_infection(user_id, version)
+				remaining -= size
+			elif split_size is None or size < split_size:
+				split_root = user_id
+				split_size = size
+
+		if remaining == 0:
+			return (num_infected, None)
+
+		# Every component large enough to split has been skipped; if there are
+		# none, we've already infected every user in the graph
+		if split_root is None:
+			return (num_infected, None)
+
+		condition = lambda num_infected : num_infected < remaining
+		num_split = self.infect_while_condition(split_root, version, condition)[0]
+		return (num_infected + num_split, split_root)
+
 	def component_size(self, root_id, visited_users=None):
 		'''
 		Returns the size of the connected component of the graph containing
@@ -272,10 +708,14 @@ class Graph:
 		visited_users.add(root_id)
 		component_size = 0
 		bft_queue = deque([root_id])
+		counting = self.stats is not None
+		edges_visited = 0
 
 		while len(bft_queue) != 0:
 			current_user = self.lookup_user(bft_queue.popleft())
 			component_size += 1
+			if counting:
+				edges_visited += len(current_user.students) + len(current_user.coached_by)
 
 			for student_id in current_user.students:
 				if student_id not in visited_users:
@@ -287,6 +727,9 @@ class Graph:
 					bft_queue.append(coach_id)
 					visited_users.add(coach_id)
 
+		if counting:
+			self.stats.add("nodes_visited", component_size)
+			self.stats.add("edges_visited", edges_visited)
 		return component_size
 
 	def get_component_sizes(self):
@@ -299,15 +742,13 @@ class Graph:
 		'''
 
 		if not self.update_cache:
+			if self.stats is not None:
+				self.stats.add("cache_hits")
 			return self.cached_component_sizes
 
-		self.cached_component_sizes = {}
-		visited_users = set()
-		for user_id in self.users:
-			if user_id not in visited_users:
-				component_size = self.component_size(user_id, visited_users)	
-				self.cached_component_sizes[user_id] = component_size
-
+		if self.stats is not None:
+			self.stats.add("cache_misses")
+		self.cached_component_sizes = self.components.sizes()
 		self.update_cache = False
 		return self.cached_component_sizes
 
@@ -321,6 +762,7 @@ class Graph:
 
 		return users_and_sizes
 
+	@records_infection
 	def total_infection_multiple(self, roots, version):
 		'''
 		Totally infects the connected component of the graph containing 
@@ -381,6 +823,9 @@ class Graph:
 		num_rows = target + epsilon + 1
 		num_cols = num_components + 1
 		partial_sols = [[False] * num_cols for i in range(num_rows)]
+		if self.stats is not None:
+			self.stats.add("dp_cells", num_rows * num_cols)
+			self.stats.record_peak("dp_table_cells", num_rows * num_cols)
 
 		# The empty set gives us a sum of 0
 		for j in range(num_components + 1):
@@ -476,6 +921,7 @@ class Graph:
 				return upper_sol
 		return False
 
+	@records_infection
 	def approximate_infection(self, target_quantity, version, epsilon=None):
 
 		'''
@@ -515,6 +961,378 @@ class Graph:
 		return False
 
 
+	def reachable_sums(self, sizes, limit):
+		'''
+		Subset-sum search over a list of component sizes that only keeps one
+		entry per reachable sum (rather than one per sum and component, as
+		subsets_to_infect does).
+
+		Args:
+			sizes (list): The sizes of the components we may infect.
+			limit (int): The largest sum we're interested in.
+
+		Returns:
+			A list of length limit + 1. The entry at index i is None if no
+			subset of <sizes> sums up to i, and otherwise a tuple of the form
+			(j, prev_i): some solution for i includes sizes[j] and extends a
+			solution for prev_i that only uses sizes before index j. The entry
+			at index 0 is (None, None).
+		'''
+
+		parents = [None] * (limit + 1)
+		parents[0] = (None, None)
+		highest = 0
+		cells = 0
+		for j, size in enumerate(sizes):
+			if size > limit:
+				continue
+			# Iterate downwards so that each size is used at most once
+			for i in xrange(min(highest, limit - size), -1, -1):
+				if parents[i] is not None and parents[i + size] is None:
+					parents[i + size] = (j, i)
+			cells += min(highest, limit - size) + 1
+			highest = min(limit, highest + size)
+
+		if self.stats is not None:
+			self.stats.add("dp_cells", cells)
+			self.stats.record_peak("dp_table_cells", limit + 1)
+		return parents
+
+	def exact_multi_arm_assignment(self, sizes, arms):
+		'''
+		Multi-dimensional version of reachable_sums: finds the assignment of
+		components to arms that satisfies every arm with the smallest total
+		error, if one exists. Each state is a tuple holding the number of
+		users assigned to each arm so far, so this takes time proportional to
+		len(sizes) times the product of (target + epsilon + 1) over the arms.
+
+		Args:
+			sizes (list): The sizes of the components we may infect.
+			arms (list): A list of (version, target_quantity, epsilon) tuples.
+
+		Returns:
+			A list containing, for each arm, a list of indices into <sizes>,
+			or False if no assignment satisfies every arm.
+		'''
+
+		limits = [target_quantity + epsilon for version, target_quantity, epsilon in arms]
+		start = (0,) * len(arms)
+
+		# Maps each reachable state to (j, k, prev_state): some assignment
+		# reaching it gives sizes[j] to arm k and extends an assignment
+		# reaching prev_state that only uses sizes before index j
+		parents = {start: None}
+		cells = 0
+		for j, size in enumerate(sizes):
+			# Iterate over a snapshot so that each size is used at most once
+			states = parents.keys()
+			cells += len(states)
+			for state in states:
+				for k in range(len(arms)):
+					if state[k] + size > limits[k]:
+						continue
+					new_state = state[:k] + (state[k] + size,) + state[k + 1:]
+					if new_state not in parents:
+						parents[new_state] = (j, k, state)
+
+		if self.stats is not None:
+			self.stats.add("dp_cells", cells)
+			self.stats.record_peak("dp_table_cells", len(parents))
+
+		best = None
+		best_error = None
+		for state in parents:
+			errors = [abs(state[k] - arms[k][1]) for k in range(len(arms))]
+			if all(errors[k] <= arms[k][2] for k in range(len(arms))):
+				if best is None or sum(errors) < best_error:
+					best = state
+					best_error = sum(errors)
+		if best is None:
+			return False
+
+		assignment = [[] for arm in arms]
+		state = best
+		while parents[state] is not None:
+			j, k, state = parents[state]
+			assignment[k].append(j)
+		return assignment
+
+	def search_multi_arm_assignment(self, sizes, arms, max_attempts=MULTI_ARM_MAX_ATTEMPTS):
+		'''
+		Heuristic alternative to exact_multi_arm_assignment for large inputs.
+		Arms are solved one at a time with reachable_sums, each taking a
+		reachable sum as close to its target as possible from the components
+		left over by the previous arms. If a later arm can't be satisfied, we
+		backtrack and try the earlier arm's other acceptable sums, and then
+		other orders of the arms, until <max_attempts> sums have been tried.
+
+		Returns:
+			A list containing, for each arm, a list of indices into <sizes>,
+			or False if no assignment was found.
+		'''
+
+		if len(arms) <= 4:
+			orders = list(permutations(range(len(arms))))
+		else:
+			descending = sorted(range(len(arms)), key=lambda k: -arms[k][1])
+			orders = [descending, descending[::-1], range(len(arms))]
+
+		attempts = [max_attempts]
+		taken = [False] * len(sizes)
+
+		def solve(order, depth):
+			if depth == len(order):
+				return [None] * len(arms)
+
+			k = order[depth]
+			version, target_quantity, epsilon = arms[k]
+			available = [j for j in range(len(sizes)) if not taken[j]]
+			parents = self.reachable_sums([sizes[j] for j in available],
+				target_quantity + epsilon)
+
+			# Try acceptable sums in order of increasing error
+			for i in range(epsilon + 1):
+				for total in sorted(set([target_quantity - i, target_quantity + i])):
+					if total < 0 or parents[total] is None:
+						continue
+					if attempts[0] == 0:
+						return False
+					attempts[0] -= 1
+
+					chosen = []
+					while total != 0:
+						j, total = parents[total]
+						chosen.append(available[j])
+					for j in chosen:
+						taken[j] = True
+					assignment = solve(order, depth + 1)
+					if assignment is not False:
+						assignment[k] = chosen
+						return assignment
+					for j in chosen:
+						taken[j] = False
+			return False
+
+		for order in orders:
+			assignment = solve(order, 0)
+			if assignment is not False:
+				return assignment
+		return False
+
+	@records_infection
+	def multi_arm_infection(self, arms, max_exact_cells=MULTI_ARM_EXACT_CELLS):
+		'''
+		Assigns disjoint sets of connected components to several versions at
+		once (e.g. for an A/B/C test), then totally infects them all in a
+		single pass. A single computation and sort of the component sizes is
+		shared across arms.
+
+		If the number of components times the product of (target + epsilon
+		+ 1) over the arms is at most <max_exact_cells>, the assignment is
+		found with exact_multi_arm_assignment, so we only fail if no valid
+		assignment exists. Otherwise we use search_multi_arm_assignment,
+		which is still exact for a single arm (it's then the same search as
+		approximate_infection), but for several arms may fail on inputs for
+		which some valid assignment exists. Either way, when we succeed every
+		arm is within its epsilon.
+
+		Args:
+			arms (list): A list of (version, target_quantity, epsilon) tuples.
+			max_exact_cells (int): The largest search for which we use the
+			exact method.
+
+		Returns:
+			A list containing the number of users infected for each arm (in
+			the order the arms were passed in) if every arm could be satisfied,
+			False otherwise. Nobody is infected on failure.
+		'''
+
+		users_and_sizes = self.get_component_sizes_tuples()
+		sizes = [size for user_id, size in users_and_sizes]
+
+		cells = len(sizes)
+		for version, target_quantity, epsilon in arms:
+			cells *= target_quantity + epsilon + 1
+		if cells <= max_exact_cells:
+			assignment = self.exact_multi_arm_assignment(sizes, arms)
+		else:
+			assignment = self.search_multi_arm_assignment(sizes, arms)
+		if assignment is False:
+			return False
+
+		# Every arm was satisfied, so apply all of the version writes
+		results = [0] * len(arms)
+		for k, indices in enumerate(assignment):
+			roots = [users_and_sizes[j][0] for j in indices]
+			results[k] = self.total_infection_multiple(roots, arms[k][0])
+		return results
+
+	def get_component_size_histogram(self):
+		'''
+		Returns a dict mapping each component size to the number of connected
+		components of that size. This is maintained as the graph changes, so
+		it doesn't require a traversal of the graph.
+		'''
+		return self.components.histogram()
+
+	def stratified_quotas(self, target_quantity, epsilon):
+		'''
+		Uses the component size histogram to decide how many components of each
+		size to totally infect so that components of many different sizes are
+		infected.
+
+		Component sizes are bucketed by powers of two (1, 2-3, 4-7, ...) and each
+		non-empty bucket is given an equal share of the target. Each bucket fills
+		its share greedily starting with its largest components, after which any
+		shortfall is filled greedily from whatever components are left over.
+
+		If the greedy choices miss the acceptable range, we search exactly (see
+		histogram_subset) for leftover components that make up the difference,
+		and failing that, for any selection of components in the range. So this
+		only fails if no selection of components infects an acceptable number
+		of users.
+
+		Args:
+			target_quantity (int): The desired number of users to infect.
+			epsilon (int): The acceptable range of error in the number of users we
+			infect.
+
+		Returns:
+			A dict mapping component sizes to the number of components of that
+			size to infect, such that the quotas infect a number of users in the
+			range target_quantity +- epsilon, or False if that's impossible.
+		'''
+
+		histogram = self.get_component_size_histogram()
+		buckets = {}
+		for size in histogram:
+			buckets.setdefault(size.bit_length(), []).append(size)
+
+		quotas = dict((size, 0) for size in histogram)
+		total = 0
+
+		if len(buckets) != 0:
+			share = target_quantity / len(buckets)
+			for sizes in buckets.values():
+				bucket_total = 0
+				for size in sorted(sizes, reverse=True):
+					count = min(histogram[size], (share - bucket_total) / size)
+					quotas[size] += count
+					bucket_total += count * size
+				total += bucket_total
+
+		# Fill the remainder from the largest leftover components that fit
+		for size in sorted(histogram, reverse=True):
+			count = min(histogram[size] - quotas[size], (target_quantity - total) / size)
+			if count > 0:
+				quotas[size] += count
+				total += count * size
+
+		# Every leftover component is now larger than the remainder. Look for
+		# leftover components that make up the difference, keeping the greedy
+		# choices, and if there are none, for any acceptable selection.
+		if total < target_quantity - epsilon:
+			leftover = dict((size, histogram[size] - quotas[size]) for size in histogram)
+			extra = self.histogram_subset(leftover, target_quantity - epsilon - total,
+				target_quantity + epsilon - total, target_quantity - total)
+			if extra is not False:
+				for size, count in extra.iteritems():
+					quotas[size] += count
+			else:
+				quotas = self.histogram_subset(histogram, target_quantity - epsilon,
+					target_quantity + epsilon, target_quantity)
+				if quotas is False:
+					return False
+
+		return dict((size, count) for size, count in quotas.iteritems() if count > 0)
+
+	def histogram_subset(self, histogram, low, high, target):
+		'''
+		Bounded subset-sum search over a histogram of component sizes: finds
+		how many components of each size to infect so that the number of
+		infected users is in the range [low, high], as close as possible to
+		<target>. Takes time proportional to <high> times the number of
+		distinct sizes.
+
+		Args:
+			histogram (dict): Maps component sizes to the number of components
+			of that size that may be infected.
+			low (int): The smallest acceptable sum.
+			high (int): The largest acceptable sum.
+			target (int): The preferred sum.
+
+		Returns:
+			A dict mapping component sizes to counts, or False if no
+			acceptable sum can be reached.
+		'''
+
+		if high < 0:
+			return False
+
+		# last_size[i] is the size of some component in a solution for i,
+		# whose other components form a solution for i - last_size[i]
+		last_size = [None] * (high + 1)
+		last_size[0] = 0
+		cells = 0
+		for size, available in histogram.iteritems():
+			if size > high or available <= 0:
+				continue
+			# used[i] is the number of components of this size in the
+			# solution for i, if it was first reached using this size
+			used = [0] * (high + 1)
+			for i in xrange(size, high + 1):
+				previous = i - size
+				if last_size[i] is None and last_size[previous] is not None and \
+					used[previous] < available:
+					last_size[i] = size
+					used[i] = used[previous] + 1
+			cells += high + 1 - size
+
+		if self.stats is not None:
+			self.stats.add("dp_cells", cells)
+
+		reachable = [i for i in xrange(max(low, 0), high + 1) if last_size[i] is not None]
+		if len(reachable) == 0:
+			return False
+
+		counts = {}
+		i = min(reachable, key=lambda i: abs(i - target))
+		while i != 0:
+			counts[last_size[i]] = counts.get(last_size[i], 0) + 1
+			i -= last_size[i]
+		return counts
+
+	@records_infection
+	def stratified_infection(self, target_quantity, version, epsilon=None):
+		'''
+		Attempts to infect a number of users in the range target_quantity +-
+		epsilon by totally infecting connected components of many different
+		sizes (see stratified_quotas), rather than getting as close as possible
+		to target_quantity. Components of each size are chosen at random.
+
+		Args:
+			target_quantity (int): The desired number of infected users
+			version (int): The version with which we infect users
+			epsilon (int): The acceptable range of error in the number of users
+			we infect. Defaults to target_quantity.
+
+		Returns:
+			The number of infected users if it is possible to infect an
+			acceptable number of users, False otherwise.
+		'''
+		if epsilon is None:
+			epsilon = target_quantity
+
+		quotas = self.stratified_quotas(target_quantity, epsilon)
+		if quotas is False:
+			return False
+
+		roots = []
+		for size, count in quotas.iteritems():
+			roots.extend(self.components.sample(size, count))
+		return self.total_infection_multiple(roots, version)
+
+	@records_infection
 	def exact_infection(self, target_quantity, version):
 		'''
 		Runs approximate infection with a tolerance of 0 (i.e. we either
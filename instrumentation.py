@@ -0,0 +1,142 @@
+import json
+from timeit import default_timer
+
+class Stats:
+	def __init__(self):
+		'''
+		Records call counts, wall times, work counters (e.g. nodes visited)
+		and peak structure sizes for instrumented Graph methods. See
+		Graph.enable_stats.
+		'''
+
+		# Functions that are passed a snapshot of the stats when export is
+		# called, e.g. to forward them to a metrics pipeline
+		self.exporters = []
+		self.reset()
+
+	def reset(self):
+		'''
+		Discards everything recorded so far.
+		'''
+
+		# Maps method names to the number of times they were called, and
+		# their total wall time in seconds
+		self.calls = {}
+		self.seconds = {}
+
+		# Maps method names to histograms of their wall times. Each histogram
+		# maps an integer b to the number of calls that took between
+		# 2^(b - 1) and 2^b microseconds (b = 0 covers calls under 1us)
+		self.time_histograms = {}
+
+		# Maps method names to dicts mapping counter names to totals
+		self.counters = {}
+
+		# Maps structure names to the largest size they've been seen with
+		self.peaks = {}
+
+		# Names of the instrumented methods currently running. Counters are
+		# added to every method in this stack, so like wall times they
+		# include work done by nested calls.
+		self.stack = []
+
+	def timed(self, name, function, after=None):
+		'''
+		Returns a wrapper around <function> that records each call under
+		<name>, then calls <after> (if provided) with no arguments.
+		'''
+
+		def wrapper(*args, **kwargs):
+			self.stack.append(name)
+			start = default_timer()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.record_call(name, default_timer() - start)
+				self.stack.pop()
+				if after is not None:
+					after()
+		wrapper.__name__ = function.__name__
+		wrapper.__doc__ = function.__doc__
+		return wrapper
+
+	def record_call(self, name, seconds):
+		self.calls[name] = self.calls.get(name, 0) + 1
+		self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+		bucket = int(seconds * 1000000).bit_length()
+		histogram = self.time_histograms.setdefault(name, {})
+		histogram[bucket] = histogram.get(bucket, 0) + 1
+
+	def add(self, counter, amount=1):
+		'''
+		Adds <amount> to the specified counter of each running method.
+		'''
+
+		for name in set(self.stack):
+			counters = self.counters.setdefault(name, {})
+			counters[counter] = counters.get(counter, 0) + amount
+
+	def record_peak(self, structure, size):
+		if size > self.peaks.get(structure, 0):
+			self.peaks[structure] = size
+
+	def snapshot(self):
+		'''
+		Returns a dict containing copies of everything recorded so far.
+		'''
+
+		return {
+			"calls": dict(self.calls),
+			"seconds": dict(self.seconds),
+			"time_histograms": dict((name, dict(histogram))
+				for name, histogram in self.time_histograms.iteritems()),
+			"counters": dict((name, dict(counters))
+				for name, counters in self.counters.iteritems()),
+			"peaks": dict(self.peaks)
+		}
+
+	def add_exporter(self, exporter):
+		'''
+		Registers a function to be called with a snapshot (see snapshot)
+		each time export is called.
+		'''
+
+		self.exporters.append(exporter)
+
+	def export(self):
+		'''
+		Passes a snapshot of the stats to each registered exporter.
+		'''
+
+		snapshot = self.snapshot()
+		for exporter in self.exporters:
+			exporter(snapshot)
+		return snapshot
+
+	def report(self):
+		'''
+		Returns a human-readable summary of the stats as a list of lines.
+		'''
+
+		lines = []
+		for name in sorted(self.calls):
+			calls = self.calls[name]
+			lines.append("%s: %s calls, %.6f s total, %.6f s per call"%(name, calls,
+				self.seconds[name], self.seconds[name] / calls))
+			for counter, total in sorted(self.counters.get(name, {}).items()):
+				lines.append("    %s: %s"%(counter, total))
+		for structure, size in sorted(self.peaks.items()):
+			lines.append("peak %s: %s"%(structure, size))
+		return lines
+
+def json_file_exporter(path):
+	'''
+	Returns an exporter (see Stats.add_exporter) that writes each snapshot
+	to the file at the specified path as JSON.
+	'''
+
+	def exporter(snapshot):
+		with open(path, "w") as output:
+			json.dump(snapshot, output, indent=2, sort_keys=True)
+	return exporter
@@ -1,8 +1,23 @@
 import random
 import unittest
+import differential
+from changefeed import Replica
 from graph import *
 MAX_USERS = 10000
 
+# Number of random operation sequences checked by the differential tests,
+# and the number of operations in each
+DIFFERENTIAL_SEEDS = 30
+DIFFERENTIAL_STEPS = 100
+
+# Number of users in the graphs built with generator.py
+SYNTHETIC_USERS = 100000
+
+try:
+    import generator
+except ImportError:
+    generator = None
+
 class TestInfectionFunctions(unittest.TestCase):
 
     def setUp(self):
@@ -69,8 +84,8 @@ class TestInfectionFunctions(unittest.TestCase):
 
 
     def set_all_versions(self, version):
-        for user in self.graph.users.values():
-            user.version = version
+        for user_id in self.graph.users:
+            self.graph.set_version(user_id, version)
 
     def test_total_infection(self):
         # Set all users' version to <old_version>
@@ -119,6 +134,29 @@ class TestInfectionFunctions(unittest.TestCase):
         # Set the version of all users to <old_version>
         self.set_all_versions(self.old_version)
 
+    def test_limited_infection_components(self):
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+        target_quantity = random.randint(0, self.num_users)
+        num_infected, split_root = self.graph.limited_infection_components(
+            target_quantity, self.new_version)
+        self.assertEquals(num_infected, target_quantity)
+
+        # Only the component containing <split_root> may be partially
+        # infected, and every infected user must be counted
+        total_new = 0
+        for component in self.components:
+            versions = set(map(lambda user : user.version, component))
+            total_new += len([user for user in component
+                if user.version == self.new_version])
+            if len(versions) > 1:
+                self.assertTrue(split_root in [user.id for user in component])
+        self.assertEquals(total_new, target_quantity)
+
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
     def test_component_size(self):
         for component in self.components:
             size = len(component)            
@@ -131,6 +169,172 @@ class TestInfectionFunctions(unittest.TestCase):
         known_sizes = sorted(self.component_to_size.values())
         self.assertEquals(sizes, known_sizes)        
 
+    def test_component_size_histogram(self):
+        known_histogram = {}
+        for size in self.component_to_size.values():
+            known_histogram[size] = known_histogram.get(size, 0) + 1
+        self.assertEquals(self.graph.get_component_size_histogram(), known_histogram)
+
+        # Split a random component by removing an edge, and remove a
+        # random user, then compare against a fresh traversal
+        component = random.choice(self.components)
+        for user in component:
+            if user.students:
+                self.graph.remove_edge(user.id, next(iter(user.students)))
+                break
+        self.graph.remove_user(random.choice(self.graph.users.keys()))
+
+        known_histogram = {}
+        visited = set()
+        for user_id in self.graph.users:
+            if user_id not in visited:
+                size = self.graph.component_size(user_id, visited)
+                known_histogram[size] = known_histogram.get(size, 0) + 1
+        self.assertEquals(self.graph.get_component_size_histogram(), known_histogram)
+
+    def test_stratified_infection(self):
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+        target_quantity = random.randint(0, self.num_users)
+        epsilon = random.randint(0, target_quantity)
+        num_infected = self.graph.stratified_infection(target_quantity,
+            self.new_version, epsilon)
+
+        if num_infected is not False:
+            self.assertTrue(abs(num_infected - target_quantity) <= epsilon)
+
+            # Only whole components may be infected
+            total_new = 0
+            for component in self.components:
+                versions = set(map(lambda user : user.version, component))
+                self.assertEquals(len(versions), 1)
+                if self.new_version in versions:
+                    total_new += len(component)
+            self.assertEquals(total_new, num_infected)
+
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+    def test_stratified_infection_feasible(self):
+        # Stars of 5, 3 and 2 users. The greedy quotas pick 3 + 2, which
+        # can't be extended to 7, but 5 + 2 can be infected.
+        graph = Graph()
+        for size in [5, 3, 2]:
+            center = graph.create_user(1)
+            for i in range(size - 1):
+                graph.add_edge(center.id, graph.create_user(1).id)
+
+        self.assertEquals(graph.stratified_quotas(7, 0), {5: 1, 2: 1})
+        self.assertEquals(graph.stratified_infection(7, 2, 0), 7)
+        self.assertEquals(graph.version_counts(), {1: 3, 2: 7})
+        self.assertEquals(graph.stratified_infection(4, 3, 0), False)
+
+    def test_rollback(self):
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+        # Move a random component to a third version, then infect some
+        # users (possibly including that component) with <new_version>
+        third_version = self.new_version + 1
+        root = random.choice(random.choice(self.components))
+        self.graph.total_infection(root.id, third_version)
+        before = dict((user.id, user.version) for user in self.graph.users.values())
+
+        target_quantity = random.randint(0, self.num_users)
+        num_infected = self.graph.limited_infection_simple(target_quantity, self.new_version)
+        infection_id = self.graph.last_infection_id
+
+        # The version index should match a full scan of the graph
+        counts = {}
+        for user in self.graph.users.values():
+            counts[user.version] = counts.get(user.version, 0) + 1
+        self.assertEquals(self.graph.version_counts(), counts)
+        self.assertEquals(len(self.graph.users_with_version(self.new_version)), num_infected)
+
+        num_changed = len([user_id for user_id in before
+            if before[user_id] != self.new_version])
+        num_restored = self.graph.rollback(infection_id)
+        self.assertTrue(num_restored <= num_changed)
+        for user in self.graph.users.values():
+            self.assertEquals(user.version, before[user.id])
+
+        # An infection can only be rolled back once
+        self.assertEquals(self.graph.rollback(infection_id), False)
+
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+    def test_undo_log_retention(self):
+        graph = Graph(max_undo_logs=2)
+        users = [graph.create_user(1) for i in range(3)]
+
+        # Infections that change nothing don't keep an undo log
+        graph.total_infection(users[0].id, 1)
+        self.assertEquals(len(graph.undo_logs), 0)
+        self.assertEquals(graph.rollback(graph.last_infection_id), False)
+        self.assertEquals(graph.exact_infection(10, 2), False)
+        self.assertEquals(len(graph.undo_logs), 0)
+
+        # Only the newest logs are kept
+        infection_ids = []
+        for user in users:
+            graph.total_infection(user.id, 2)
+            infection_ids.append(graph.last_infection_id)
+        self.assertEquals(list(graph.undo_logs), infection_ids[1:])
+        self.assertEquals(graph.rollback(infection_ids[0]), False)
+
+        self.assertTrue(graph.discard_undo_log(infection_ids[1]))
+        self.assertFalse(graph.discard_undo_log(infection_ids[1]))
+        self.assertEquals(graph.rollback(infection_ids[2]), 1)
+        self.assertEquals(users[2].version, 1)
+
+    def test_bulk_load_mismatched_lengths(self):
+        graph = Graph()
+        self.assertFalse(graph.bulk_load([1, 2, 3], [1]))
+        self.assertFalse(graph.bulk_load([1, 2], [1, 1], [1], [2, 1]))
+        self.assertEquals(graph.users, {})
+        self.assertEquals(graph.get_component_sizes(), {})
+
+        self.assertTrue(graph.bulk_load([1, 2], [1, 1], [1], [2]))
+        self.assertEquals(graph.get_component_sizes().values(), [2])
+
+    def test_stats(self):
+        # Stars of 4, 3, 2 and 1 users
+        graph = Graph()
+        for size in [4, 3, 2, 1]:
+            center = graph.create_user(1)
+            for i in range(size - 1):
+                graph.add_edge(center.id, graph.create_user(1).id)
+
+        stats = graph.enable_stats()
+        graph.update_cache = True
+        graph.get_component_sizes()
+        graph.get_component_sizes()
+        self.assertEquals(stats.counters["get_component_sizes"],
+            {"cache_hits": 1, "cache_misses": 1})
+
+        # Nested calls count towards each instrumented caller
+        num_infected = graph.approximate_infection(5, 2, 1)
+        self.assertTrue(4 <= num_infected <= 6)
+        self.assertEquals(stats.calls["approximate_infection"], 1)
+        self.assertTrue(stats.counters["approximate_infection"]["dp_cells"] > 0)
+        self.assertEquals(stats.counters["approximate_infection"].get("nodes_visited", 0),
+            num_infected)
+        self.assertEquals(stats.peaks["users"], 10)
+
+        exported = []
+        stats.add_exporter(exported.append)
+        stats.export()
+        self.assertEquals(exported[0]["calls"], stats.calls)
+
+        # Disabling removes the timing wrappers
+        graph.disable_stats()
+        self.assertFalse("total_infection" in graph.__dict__)
+        calls = stats.calls.get("total_infection", 0)
+        graph.total_infection(1, 3)
+        self.assertEquals(stats.calls.get("total_infection", 0), calls)
+
     def test_exact_infection(self):
         # Set the version of all users to <old_version>
         self.set_all_versions(self.old_version)
@@ -155,5 +359,260 @@ class TestInfectionFunctions(unittest.TestCase):
         # Set the version of all users to <old_version>
         self.set_all_versions(self.old_version)
 
+    def test_multi_arm_infection(self):
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+        # Split a random subset of components between two new versions so
+        # that exact targets are known to be achievable
+        third_version = self.new_version + 1
+        indices = range(0, self.num_components)
+        random.shuffle(indices)
+        split = random.randint(0, self.num_components)
+        first_users = sum([ self.component_to_size[index] for index in indices[:split] ])
+        # Keep the second target no larger than the first so that the
+        # exact arm is solved first
+        second_users = min(self.num_users - first_users, first_users)
+
+        arms = [(self.new_version, first_users, 0),
+            (third_version, second_users, second_users)]
+        results = self.graph.multi_arm_infection(arms)
+        self.assertNotEquals(results, False)
+        self.assertEquals(results[0], first_users)
+
+        # Each arm's components must be disjoint from the others'
+        counts = {}
+        for user in self.graph.users.values():
+            counts[user.version] = counts.get(user.version, 0) + 1
+        self.assertEquals(counts.get(self.new_version, 0), results[0])
+        self.assertEquals(counts.get(third_version, 0), results[1])
+
+        # Set the version of all users to <old_version>
+        self.set_all_versions(self.old_version)
+
+@unittest.skipIf(generator is None, "generator.py requires NumPy")
+class TestSyntheticGraphs(unittest.TestCase):
+
+    def test_generate_is_reproducible(self):
+        for shape in generator.SHAPES:
+            first = generator.generate(1000, shape, seed=7)
+            second = generator.generate(1000, shape, seed=7)
+            self.assertEquals(first.user_ids.tolist(), second.user_ids.tolist())
+            self.assertEquals(first.coach_ids.tolist(), second.coach_ids.tolist())
+            self.assertEquals(first.student_ids.tolist(), second.student_ids.tolist())
+
+    def test_bulk_load(self):
+        for shape in generator.SHAPES:
+            synthetic = generator.generate(SYNTHETIC_USERS, shape,
+                seed=random.randint(0, 1000), versions=(1, 2))
+            self.assertEquals(synthetic.sizes.sum(), SYNTHETIC_USERS)
+
+            graph = Graph()
+            self.assertTrue(synthetic.load(graph))
+            self.assertEquals(len(graph.users), SYNTHETIC_USERS)
+            self.assertEquals(sorted(graph.get_component_sizes().values()),
+                sorted(synthetic.sizes.tolist()))
+
+            # Users in the same generated component must be in the same
+            # connected component of the graph
+            component = random.randint(0, len(synthetic.sizes) - 1)
+            members = synthetic.members(component).tolist()
+            labels = set(graph.components.component_of[user_id] for user_id in members)
+            self.assertEquals(len(labels), 1)
+            self.assertEquals(graph.component_size(members[0]), len(members))
+
+            # Loading the same users twice should fail
+            self.assertFalse(synthetic.load(graph))
+
+class GraphWithoutSplits(Graph):
+    # Forgets to update its components when edges are removed
+    def remove_edge(self, coach_id, student_id):
+        coach = self.lookup_user(coach_id)
+        student = self.lookup_user(student_id)
+        if student is None or coach is None:
+            return False
+        student.coached_by.discard(coach_id)
+        coach.students.discard(student_id)
+        self.update_cache = True
+        return True
+
+class TestDifferential(unittest.TestCase):
+
+    def test_engines_agree(self):
+        for engine_name in sorted(differential.ENGINES):
+            factory = differential.load_engine(engine_name)
+            for seed in range(DIFFERENTIAL_SEEDS):
+                operations = differential.random_operations(seed, DIFFERENTIAL_STEPS)
+                self.assertEquals(differential.run_operations(operations, factory), None)
+
+    def test_shrink(self):
+        operations = [("create_user", 1) for i in range(5)]
+        operations += [("add_edge", 2, 4), ("total_infection", 3, 2),
+            ("remove_edge", 2, 4), ("create_user", 3)]
+        self.assertNotEquals(differential.run_operations(operations,
+            GraphWithoutSplits), None)
+
+        # Two users, an edge between them, and its removal
+        shrunk = differential.shrink(operations, GraphWithoutSplits)
+        self.assertEquals(len(shrunk), 4)
+        self.assertEquals([operation[0] for operation in shrunk],
+            ["create_user", "create_user", "add_edge", "remove_edge"])
+
+class TestChangeFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.operations = differential.random_operations(random.randint(0, 1000),
+            DIFFERENTIAL_STEPS)
+
+    def test_replica(self):
+        self.graph.enable_change_feed()
+        replica = Replica(self.graph)
+        for operation in self.operations:
+            differential.apply_operation(self.graph, operation)
+            if random.random() < 0.2:
+                self.assertNotEquals(replica.update(), None)
+        replica.update()
+
+        versions = dict((user_id, user.version)
+            for user_id, user in self.graph.users.iteritems())
+        edges = set((user_id, student_id) for user_id, user in self.graph.users.iteritems()
+            for student_id in user.students)
+        self.assertEquals(replica.versions, versions)
+        self.assertEquals(replica.edges(), edges)
+
+    def test_create_user_with_relationships(self):
+        self.graph.enable_change_feed()
+        replica = Replica(self.graph)
+        first = self.graph.create_user(1)
+
+        # Relationships with nonexistent users are ignored, and the others
+        # are added in both directions
+        second = self.graph.create_user(2, students=set([first.id, 99]),
+            coached_by=set([first.id]))
+        self.assertEquals(second.students, set([first.id]))
+        self.assertEquals(first.coached_by, set([second.id]))
+        self.assertEquals(first.students, set([second.id]))
+        self.assertEquals(self.graph.component_size(first.id), 2)
+
+        self.assertEquals(replica.update(), 4)
+        self.assertEquals(replica.edges(),
+            set([(first.id, second.id), (second.id, first.id)]))
+        self.assertEquals(replica.versions, {first.id: 1, second.id: 2})
+
+    def test_unsubscribe(self):
+        feed = self.graph.enable_change_feed()
+        batches = []
+        subscription = feed.subscribe(callback=batches.append, batch_size=1)
+        self.graph.create_user(1)
+        self.assertEquals(len(batches), 1)
+
+        feed.unsubscribe(subscription)
+        self.assertEquals(feed.push_subscriptions, [])
+        self.graph.create_user(1)
+        self.assertEquals(len(batches), 1)
+
+    def test_batches_and_gaps(self):
+        feed = self.graph.enable_change_feed(capacity=8)
+        batches = []
+        pushed = feed.subscribe(callback=batches.append, batch_size=3)
+        polled = feed.subscribe()
+
+        for operation in self.operations:
+            differential.apply_operation(self.graph, operation)
+        pushed.flush()
+
+        # Pushed batches are no larger than the batch size and have no gaps
+        sequence = 0
+        for batch in batches:
+            self.assertTrue(len(batch) <= 3)
+            self.assertEquals(batch.missed, 0)
+            self.assertEquals(batch.first_sequence, sequence)
+            sequence += len(batch)
+        self.assertEquals(sequence, feed.next_sequence)
+
+        # The polling subscriber fell behind and is told what it missed
+        batch = polled.poll()
+        if feed.next_sequence > 8:
+            self.assertEquals(batch.missed, feed.next_sequence - 8)
+        self.assertEquals(len(batch), min(8, feed.next_sequence))
+        self.assertEquals(polled.lag(), 0)
+
+class TestMultiArmInfection(unittest.TestCase):
+
+    def setUp(self):
+        # Components of sizes 6, 5, 5, 4, 2 and 1. Arms of exactly 9 and
+        # exactly 4 users can only be satisfied by 6 + 2 + 1 and 4, so
+        # giving the first arm 5 + 4 leaves the second unsatisfiable.
+        self.graph = Graph()
+        self.sizes = [6, 5, 5, 4, 2, 1]
+        for size in self.sizes:
+            users = [self.graph.create_user(1) for i in range(size)]
+            for user in users[1:]:
+                self.graph.add_edge(users[0].id, user.id)
+        self.arms = [(2, 9, 0), (3, 4, 0)]
+
+    def check_assignment(self, results):
+        self.assertEquals(results, [9, 4])
+        counts = self.graph.version_counts()
+        self.assertEquals(counts.get(2), 9)
+        self.assertEquals(counts.get(3), 4)
+
+    def test_exact(self):
+        stats = self.graph.enable_stats()
+        self.check_assignment(self.graph.multi_arm_infection(self.arms))
+        self.assertEquals(stats.calls["exact_multi_arm_assignment"], 1)
+        self.assertTrue(stats.counters["multi_arm_infection"]["dp_cells"] > 0)
+
+    def test_search(self):
+        # Force the heuristic, which has to backtrack to another arm order
+        self.check_assignment(self.graph.multi_arm_infection(self.arms,
+            max_exact_cells=0))
+
+    def test_infeasible(self):
+        # Two disjoint sets of 9 use up the 4 (5 + 4 and 6 + 2 + 1)
+        arms = [(2, 9, 0), (3, 9, 0), (4, 4, 0)]
+        for max_exact_cells in [0, MULTI_ARM_EXACT_CELLS]:
+            self.assertEquals(self.graph.multi_arm_infection(arms, max_exact_cells), False)
+        self.assertEquals(self.graph.version_counts(), {1: sum(self.sizes)})
+
+class TestComponentSplits(unittest.TestCase):
+
+    def setUp(self):
+        # A chain 1 - 2 - ... - 7, with a star of three leaves around 4
+        self.graph = Graph()
+        for i in range(10):
+            self.graph.create_user(1)
+        for user_id in range(1, 7):
+            self.graph.add_edge(user_id, user_id + 1)
+        for leaf_id in range(8, 11):
+            self.graph.add_edge(4, leaf_id)
+
+    def check_components(self, expected):
+        sizes = self.graph.get_component_sizes()
+        self.assertEquals(sorted(sizes.values()), sorted(expected))
+        for root_id, size in sizes.iteritems():
+            self.assertEquals(self.graph.component_size(root_id), size)
+
+    def test_remove_edge(self):
+        # The first user has the largest component's root, and is split off
+        self.graph.remove_edge(1, 2)
+        self.check_components([1, 9])
+
+        # Removing one direction of a mutual relationship splits nothing
+        self.graph.add_edge(6, 5)
+        self.graph.remove_edge(5, 6)
+        self.check_components([1, 9])
+
+        self.graph.remove_edge(6, 5)
+        self.check_components([1, 7, 2])
+
+    def test_remove_user(self):
+        self.graph.remove_user(4)
+        self.check_components([3, 3, 1, 1, 1])
+
+        self.graph.remove_user(1)
+        self.check_components([2, 3, 1, 1, 1])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,52 @@
+from array import array
+
+class UndoLog:
+	def __init__(self):
+		'''
+		Records the previous versions of the users changed by a single
+		infection so that it can be rolled back.
+
+		Rather than storing a (user, previous version) pair per user, we
+		store user IDs in one compact array and run-length encode their
+		previous versions (infections usually move many users off of the
+		same version), so large rollouts stay cheap to record.
+		'''
+
+		# IDs of changed users, in the order they were changed
+		self.user_ids = array('l')
+
+		# The ith run covers the next <run_lengths[i]> entries of user_ids,
+		# all of which previously had version <run_versions[i]>
+		self.run_versions = array('l')
+		self.run_lengths = array('l')
+
+	def __len__(self):
+		return len(self.user_ids)
+
+	def record(self, user_id, previous_version):
+		'''
+		Records that the user with the specified ID was changed from
+		<previous_version> to some other version.
+		'''
+
+		self.user_ids.append(user_id)
+		if len(self.run_versions) != 0 and self.run_versions[-1] == previous_version:
+			self.run_lengths[-1] += 1
+		else:
+			self.run_versions.append(previous_version)
+			self.run_lengths.append(1)
+
+	def entries(self):
+		'''
+		Yields (user_id, previous_version) pairs in the reverse of the order
+		in which they were recorded, so that if a user was changed more than
+		once, its earliest previous version is yielded last.
+		'''
+
+		end = len(self.user_ids)
+		for run in xrange(len(self.run_versions) - 1, -1, -1):
+			start = end - self.run_lengths[run]
+			previous_version = self.run_versions[run]
+			for i in xrange(end - 1, start - 1, -1):
+				yield (self.user_ids[i], previous_version)
+			end = start